@@ -1 +1 @@
-__all__ = ['xilinx', 'modelsim','scan_ise','xparseprops']
+__all__ = ['xilinx', 'modelsim','scan_ise','xparseprops','xprop_defaults','xprop_worker','hdl_signature']
@@ -0,0 +1,194 @@
+##
+## Semantic signatures for HDL sources.  A file's semantic signature
+## is the MD5 of its token stream with comments and whitespace taken
+## out, so re-commenting or re-indenting a file doesn't rebuild what
+## depends on it.
+##
+## SCons only remembers the content signature (csig) a dependency had
+## when its target was last built, so we keep a table of the semantic
+## signature of the csigs we've seen, and save it between runs.
+## Signatures of files on disk are also cached by stat, so deciding
+## about an unchanged file reads nothing.
+##
+
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+import xil_ise
+from scan_ise import hdl_language
+
+# Anything not covered below gets a token of its own, so nothing that
+# could matter is ever dropped.  Runs of operator characters stay
+# together ('++' is not '+ +'); those runs stop where a comment starts.
+# Newlines are matched so that directive lines can be ended.
+_TOKEN_RE = {
+    'verilog': re.compile(r'''(?P<comment>//[^\n]*|/\*.*?\*/)
+                             |(?P<newline>\n)
+                             |"(?:[^"\\\n]|\\.)*"
+                             |\\\S+
+                             |`\w+
+                             |\w+
+                             |(?:(?!//|/\*)[^\w\s"\\`])+
+                             |\S''', re.S | re.X),
+    'vhdl': re.compile(r'''(?P<comment>--[^\n]*|/\*.*?\*/)
+                          |(?P<newline>\n)
+                          |'[^\n]'
+                          |"(?:[^"\n]|"")*"
+                          |\\[^\\\n]*\\
+                          |\w+
+                          |(?:(?!--|/\*)[^\w\s"'\\])+
+                          |\S''', re.S | re.X),
+    }
+
+# Ends a line starting with a compiler directive (`define, `include,
+# ...), since the line end ends the directive
+LINE_END = '\n'
+
+def hdl_tokens(text, language):
+    """The tokens of HDL source text, less comments, with LINE_END
+    after each directive line (and each line it is continued on)"""
+    tokens = []
+    line_start = True
+    directive = False
+    for m in _TOKEN_RE[language].finditer(text):
+        if m.group('newline') is not None:
+            if directive:
+                tokens.append(LINE_END)
+                # A backslash continues it
+                directive = tokens[-2] == '\\'
+            line_start = True
+        elif m.group('comment') is None:
+            token = m.group()
+            if line_start and token.startswith('`'):
+                directive = True
+            line_start = False
+            tokens.append(token)
+    return tokens
+
+def semantic_hash(text, language):
+    """MD5 hex digest of the tokens of text, one per line"""
+    return hashlib.md5('\n'.join(hdl_tokens(text, language))).hexdigest()
+
+
+# Changes whenever the tokens do
+SEMANTIC_SIGS_VERSION = 3
+
+# Number of csigs saved besides those of the files last seen; the
+# least recently used go first.  Each is what some target may have
+# been built from, so one dropped costs at worst a rebuild the
+# semantic signature would have saved.
+SEMANTIC_SIGS_SIZE = 4096
+
+_lock = threading.Lock()
+# csig -> semantic signature, least recently used first
+_by_csig = OrderedDict()
+_by_path = {}           # path -> (stat signature, csig, semantic signature)
+_dirty = False
+
+def file_signatures(path):
+
+    """(csig, semantic signature) of the file at path, from the stat
+    cache if it hasn't changed"""
+
+    global _dirty
+    stat_sig = xil_ise.stat_signature(path)
+    with _lock:
+        cached = _by_path.get(path)
+    if cached is not None and cached[0] == stat_sig:
+        return cached[1], cached[2]
+    f = open(path, 'rb')
+    try:
+        text = f.read()
+    finally:
+        f.close()
+    csig = hashlib.md5(text).hexdigest()
+    semantic = semantic_hash(text, hdl_language(path))
+    with _lock:
+        _by_path[path] = (stat_sig, csig, semantic)
+        _by_csig.pop(csig, None)
+        _by_csig[csig] = semantic
+        _dirty = True
+    return csig, semantic
+
+def semantic_of_csig(csig):
+    """Semantic signature of content with this csig, if it's been seen"""
+    global _dirty
+    with _lock:
+        semantic = _by_csig.pop(csig, None)
+        if semantic is not None:
+            # Some target was built from it; now the most recently used
+            _by_csig[csig] = semantic
+            _dirty = True
+        return semantic
+
+def load_semantic_sigs(filename):
+    """Seed the tables from a file written by save_semantic_sigs"""
+    state = xil_ise.load_state(filename, SEMANTIC_SIGS_VERSION, 'HDL signature file')
+    if state is None:
+        return
+    by_csig, by_path = state
+    with _lock:
+        for (csig, semantic) in by_csig:
+            _by_csig.setdefault(csig, semantic)
+        for (path, entry) in by_path.items():
+            _by_path.setdefault(path, entry)
+
+def save_semantic_sigs(filename):
+
+    """Write the tables to filename, if they've changed.  Only the
+    csigs of the files last seen and the SEMANTIC_SIGS_SIZE most
+    recently used others are kept."""
+
+    global _dirty
+    with _lock:
+        if not _dirty:
+            return
+        current = set([entry[1] for entry in _by_path.values()])
+        others = [csig for csig in _by_csig if csig not in current]
+        keep = current.union(others[max(len(others) - SEMANTIC_SIGS_SIZE, 0):])
+        by_csig = [(csig, semantic) for (csig, semantic) in _by_csig.items()
+                   if csig in keep]
+        state = (by_csig, dict(_by_path))
+        _dirty = False
+    xil_ise.save_state(filename, SEMANTIC_SIGS_VERSION, state)
+
+# use_semantic_sigs(filename): load the signature tables in filename
+# now, and save them back when SCons exits
+use_semantic_sigs = xil_ise.saved_at_exit('HDL signatures', load_semantic_sigs, save_semantic_sigs)
+
+
+def semantic_decider():
+
+    """An SCons decider function which, when the target's environment
+    has $XISE_SEMANTIC_HDL set, and for dependencies having one of
+    $HDLSUFFIXES, only reports a change if the semantic signature
+    differs from that of the content the target was last built from.
+    The tables are kept in $XISE_SEMANTIC_SIGS_FILE, loaded when first
+    needed.  Every other dependency is decided on content, as SCons
+    does by default."""
+
+    def changed(dependency, target, prev_ni, *args):
+        env = target.get_build_env()
+        if not env.get('XISE_SEMANTIC_HDL'):
+            return dependency.changed_content(target, prev_ni)
+        suffixes = [s.lower() for s in env.get('HDLSUFFIXES', [])]
+        if (os.path.splitext(str(dependency))[1].lower() not in suffixes or
+            not dependency.exists()):
+            return dependency.changed_content(target, prev_ni)
+        prev_csig = getattr(prev_ni, 'csig', None)
+        if prev_csig is None:
+            return True
+        use_semantic_sigs(env.File(env['XISE_SEMANTIC_SIGS_FILE']).abspath)
+        csig, semantic = file_signatures(dependency.abspath)
+        if csig == prev_csig:
+            return False
+        prev_semantic = semantic_of_csig(prev_csig)
+        if prev_semantic is None:
+            # Never saw what it was built from
+            return True
+        return semantic != prev_semantic
+
+    return changed
@@ -3,48 +3,334 @@
 
 import re
 import string
+import os.path
 
 import SCons.Scanner
+import SCons.Node.FS
+import SCons.Warnings
+
+import xil_ise
+from xilinx import seq_dedup
+
+
+class ParsedScanner(SCons.Scanner.Current):
+
+    """Base for scanners that work out a file's dependencies by
+    parsing it, rather than with a regex.  Subclasses provide
+    find_include_names(node), and may override find_include and
+    sort_key to resolve and order what it returns.  Names are looked
+    for next to the file, then along the directories in
+    $path_variable; found files are scanned in turn."""
+
+    def __init__ (self, name, suffixes, path_variable):
+        SCons.Scanner.Current.__init__ (
+            self,
+            self._scan,
+            name = name,
+            skeys = suffixes,
+            path_function = SCons.Scanner.FindPathDirs(path_variable),
+            recursive = 1)
+
+    def find_include(self, include, source_dir, path):
+        n = SCons.Node.FS.find_file(include, (source_dir,) + tuple(path))
+        return n, include
+
+    def sort_key(self, include):
+        return SCons.Node.FS._my_normcase(include)
+
+    def _scan(self, node, env, path=()):
+        node = node.rfile()
+        if not node.exists():
+            return []
+        source_dir = node.get_dir()
+        if callable(path):
+            path = path()
+        nodes = []
+        for include in self.find_include_names(node):
+            n, i = self.find_include(include, source_dir, path)
+            if n is None:
+                SCons.Warnings.warn(SCons.Warnings.DependencyWarning,
+                                    "No dependency generated for file: %s (included from: %s) -- file not found" % (i, node))
+            elif n is not node:
+                nodes.append((self.sort_key(include), n))
+        return [pair[1] for pair in sorted(nodes)]
 
 def XiseScannerManual():
     """Return a prototype Scanner instance for scanning XISE project files"""
     xises = Xise(use_suffixes=False)
     return xises
 
-class Xise(SCons.Scanner.Classic):
+# Results of Xise.find_include_names, by node content signature
+_xise_includes = {}
+
+class Xise(ParsedScanner):
+
+    """Finds the FILE_COREGENISE sub-projects of a .xise file which
+    have an Implementation association, from the parsed project."""
+
     def __init__ (self, use_suffixes=True):
         suffixes = {True:'$XISESUFFIXES',
                     False:[]}
-        SCons.Scanner.Classic.__init__ (
+        ParsedScanner.__init__ (
             self,
             name = "XiseScanner",
             suffixes = suffixes,
-            path_variable = 'ISEPATH',
-            regex = '<file\s+xil_pn:name="([a-zA-Z0-9_./]+)"\s+xil_pn:type="FILE_COREGENISE">'
-            '(?:\s+<association xil_pn:name="(?!Implementation)"[^.>]*/>)*'
-            '\s+(?:\s+<association xil_pn:name="Implementation"[^.>]*/>)'
-            '(?:\s+<association xil_pn:name="(?!Implementation)"[^.>]*/>)*'
-            '\s+</file>')
+            path_variable = 'ISEPATH')
+
+    def find_include_names(self, node):
+        csig = node.get_csig()
+        try:
+            return _xise_includes[csig]
+        except KeyError:
+            pass
+        try:
+            entries = xil_ise.get_project_file_entries(node.abspath)
+        except IOError:
+            return []
+        names = [f_name for (f_name, f_type, associations) in entries
+                 if f_type == 'FILE_COREGENISE' and
+                 'Implementation' in [a_name for (a_name, a_seqid) in associations]]
+        _xise_includes[csig] = names
+        return names
 
 
 def XcoScanner():
     return Xco()
 
-class Xco(SCons.Scanner.Classic):
+# Extensions of files which cores read; a parameter with one of these
+# is taken to name a file even if its name doesn't say so.
+XCO_FILE_EXTENSIONS = ['.coe', '.mif', '.mem', '.xco', '.xise', '.ngc',
+                       '.edn', '.edf', '.ndf', '.bmm', '.elf', '.ucf', '.xcf']
+
+# Values which file-valued parameters take when there's no file
+XCO_NO_FILE_VALUES = ['', 'none', 'no_coe_file_loaded', 'true', 'false']
+
+def xco_file_params(text):
+
+    """Parse the text of a coregen .xco file, and return the files
+    named by any SET or CSET parameter, in order of appearance.  A
+    parameter names a file if its value has a file extension, and
+    either the parameter's name mentions 'file' or the extension is
+    one of XCO_FILE_EXTENSIONS."""
+
+    files = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        parts = line.split(None, 1)
+        if len(parts) != 2 or parts[0].upper() not in ['SET', 'CSET']:
+            continue
+        (key, eq, value) = parts[1].partition('=')
+        if eq == '':
+            continue
+        key = key.strip().lower()
+        value = value.strip().strip('"').replace('\\', '/')
+        if value.lower() in XCO_NO_FILE_VALUES:
+            continue
+        ext = os.path.splitext(value)[1].lower()
+        if ext != '' and ('file' in key or ext in XCO_FILE_EXTENSIONS):
+            files.append(value)
+    return files
+
+# Results of Xco.find_include_names, by node content signature
+_xco_includes = {}
+
+class Xco(ParsedScanner):
+
+    """Finds every file a coregen .xco file refers to (COE, MIF and
+    other init files, nested .xco inputs, ...), see xco_file_params.
+    Names are resolved against $ISEPATH."""
+
     def __init__ (self):
-        SCons.Scanner.Classic.__init__ (
+        ParsedScanner.__init__ (
             self,
             name = "XcoScanner",
             suffixes = ['.xco'],
-            path_variable = 'ISEPATH',
-            regex = 'CSET\s+coe_file\s*=\s*([a-zA-Z0-9./_]+)')
-    
-    # def scan(self, node, path=()):
-    #     print "Scanning %s, path =%s" % (str(node), str(path))
-    #     return SCons.Scanner.Classic.scan (self, node, path)
-
-    # def find_include_names(self, node):
-    #     print "find_include_names on %s" % (str(node))
-    #     foo = SCons.Scanner.Classic.find_include_names (self, node)
-    #     print foo
-    #     return foo
+            path_variable = 'ISEPATH')
+
+    def find_include_names(self, node):
+        csig = node.get_csig()
+        try:
+            return _xco_includes[csig]
+        except KeyError:
+            pass
+        names = xco_file_params(node.get_text_contents())
+        _xco_includes[csig] = names
+        return names
+
+
+##
+## HDL sources: Verilog `include directives and VHDL use clauses
+##
+
+# Suffixes of Verilog sources and headers, and of VHDL sources
+VERILOG_SUFFIXES = ['.v', '.vh', '.vhi', '.sv', '.svh']
+VHDL_SUFFIXES = ['.vhd', '.vhdl']
+
+# VHDL libraries which come with the tools, not from the project
+VHDL_TOOL_LIBRARIES = ['ieee', 'std', 'unisim', 'unimacro', 'simprim',
+                       'xilinxcorelib', 'synopsys', 'secureip']
+
+_comment_re = {'verilog': re.compile(r'//[^\n]*|/\*.*?\*/', re.S),
+               'vhdl': re.compile(r'--[^\n]*')}
+_include_re = re.compile(r'`include\s+"([^"\n]+)"')
+_use_re = re.compile(r'\buse\s+(\w+)\s*\.\s*(\w+)', re.I)
+_package_re = re.compile(r'\bpackage\s+(\w+)\s+is\b', re.I)
+
+def hdl_language(name):
+    ext = os.path.splitext(name)[1].lower()
+    if ext in VHDL_SUFFIXES:
+        return 'vhdl'
+    return 'verilog'
+
+def hdl_includes(text, language):
+
+    """The files a Verilog source `includes, or the packages a VHDL
+    source uses (as ('package', name) pairs), in order of appearance.
+    Commented-out lines are ignored."""
+
+    text = _comment_re[language].sub('', text)
+    if language == 'verilog':
+        return seq_dedup(_include_re.findall(text))
+    packages = [('package', package.lower())
+                for (library, package) in _use_re.findall(text)
+                if library.lower() not in VHDL_TOOL_LIBRARIES]
+    return seq_dedup(packages)
+
+def _stat_signature(path):
+    try:
+        return xil_ise.stat_signature(path)
+    except OSError:
+        return None
+
+# Packages declared by each VHDL file: path -> (stat signature, names)
+_vhdl_packages = {}
+
+def vhdl_packages(path):
+    """The names of the VHDL packages declared in a file (lower case)"""
+    stat_sig = _stat_signature(path)
+    if stat_sig is None:
+        return []
+    cached = _vhdl_packages.get(path)
+    if cached is not None and cached[0] == stat_sig:
+        return cached[1]
+    f = open(path)
+    try:
+        text = _comment_re['vhdl'].sub('', f.read())
+    finally:
+        f.close()
+    names = [name.lower() for name in _package_re.findall(text)]
+    _vhdl_packages[path] = (stat_sig, names)
+    return names
+
+# VHDL files in each directory: path -> (mtime, [file, ...])
+_vhdl_dir_files = {}
+
+def _vhdl_files(d):
+    try:
+        mtime = os.stat(d).st_mtime
+    except OSError:
+        return []
+    cached = _vhdl_dir_files.get(d)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    files = [os.path.join(d, name) for name in sorted(os.listdir(d))
+             if hdl_language(name) == 'vhdl' and os.path.isfile(os.path.join(d, name))]
+    _vhdl_dir_files[d] = (mtime, files)
+    return files
+
+# Package index of each directory: path -> (stat signatures of its
+# VHDL files, {package: file})
+_vhdl_dir_index = {}
+
+def _vhdl_index(d):
+    """{package: file} for the VHDL files in d, rebuilt whenever one
+    of them changes"""
+    files = _vhdl_files(d)
+    sigs = [(path, _stat_signature(path)) for path in files]
+    cached = _vhdl_dir_index.get(d)
+    if cached is not None and cached[0] == sigs:
+        return cached[1]
+    index = {}
+    for path in files:
+        for package in vhdl_packages(path):
+            index.setdefault(package, path)
+    _vhdl_dir_index[d] = (sigs, index)
+    return index
+
+def find_vhdl_package(package, dirs):
+    """The first VHDL file in dirs which declares package, or None"""
+    for d in dirs:
+        path = _vhdl_index(d).get(package)
+        if path is not None:
+            return path
+    return None
+
+def HdlScanner():
+    return Hdl()
+
+# Results of Hdl.find_include_names, by node content signature
+_hdl_includes = {}
+
+class Hdl(ParsedScanner):
+
+    """Finds the files a Verilog source `includes, and the files
+    declaring the packages a VHDL source uses.  Both are looked for
+    next to the source, then along $HDLINCPATH.  Packages from the
+    tools' own libraries (ieee, unisim, ...) are skipped, as is a
+    package a file declares itself."""
+
+    def __init__ (self):
+        ParsedScanner.__init__ (
+            self,
+            name = "HdlScanner",
+            suffixes = '$HDLSUFFIXES',
+            path_variable = 'HDLINCPATH')
+
+    def find_include_names(self, node):
+        csig = node.get_csig()
+        try:
+            return _hdl_includes[csig]
+        except KeyError:
+            pass
+        names = hdl_includes(node.get_text_contents(), hdl_language(str(node)))
+        _hdl_includes[csig] = names
+        return names
+
+    def find_include(self, include, source_dir, path):
+        if type(include) != tuple:
+            return ParsedScanner.find_include(self, include, source_dir, path)
+        dirs = [source_dir.abspath] + [d.abspath for d in path]
+        found = find_vhdl_package(include[1], dirs)
+        if found is None:
+            return None, include[1]
+        return source_dir.File(found), include[1]
+
+    def sort_key(self, include):
+        if type(include) == tuple:
+            return include[1]
+        return ParsedScanner.sort_key(self, include)
+
+def hdl_dependencies(nodes, env, extra_dirs=()):
+
+    """Everything the HDL nodes include or use, transitively, as found
+    by the Hdl scanner along $HDLINCPATH and then extra_dirs.  For
+    builders that learn their sources from a project file rather than
+    from their source list."""
+
+    scanner = HdlScanner()
+    path = tuple(scanner.path(env)) + tuple([env.Dir(d) for d in extra_dirs])
+    suffixes = env.subst_list('$HDLSUFFIXES')[0]
+    suffixes = [str(s) for s in suffixes]
+    found = []
+    seen = set(nodes)
+    todo = [n for n in nodes if os.path.splitext(str(n))[1].lower() in suffixes]
+    while todo:
+        node = todo.pop()
+        for dep in scanner(node, env, path):
+            if dep not in seen:
+                seen.add(dep)
+                found.append(dep)
+                todo.append(dep)
+    return found
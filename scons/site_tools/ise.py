@@ -5,12 +5,18 @@ Tool-specific initialization for Xilinx ISE
 """
 
 import sys
+import os.path
 import platform
 import xilinx
 import xparseprops
+import xil_ise
+import xprop_defaults
+import xprop_worker
 import scan_ise
+import hdl_signature
 import SCons.Util
 import pprint
+import pipes
 from SCons.Script import *
 
 
@@ -35,6 +41,13 @@ def depend_on_proj_props(target, source, env):
 
     return (target, source + [env['XISE_PY_PROPFILE']])
 
+def depend_on_proc_props(process):
+    """ Returns an emitter which adds a dependency for the properties
+    of one process only """
+    def emit(target, source, env):
+        return (target, source + [xilinx.prop_section(env, process)])
+    return emit
+
 def depend_on_proj_file(target, source, env):
     """ Emitter which adds a dependency for the project (.xise) file"""
     return (target, source + [env.subst("$PROJECTFILE")])
@@ -46,26 +59,40 @@ def announce(words):
         return
     return  doit
 
+def project_path(env):
+    """Absolute path of $PROJECTFILE, which is named relative to
+    $XISE_FSROOT (by default the top directory)"""
+    fsroot = env.subst('$XISE_FSROOT')
+    if fsroot == '':
+        fsroot = env.Dir('#').abspath
+    return os.path.normpath(os.path.join(fsroot, env.subst('$PROJECTFILE')))
+
+def expand_proj(env):
+    """The (cached) expansion of $PROJECTFILE.  Files in a project are
+    named relative to its directory, which expand_project takes care
+    of; the paths found are absolute."""
+    project = project_path(env)
+    return xilinx.expand_project_cached(project, os.path.dirname(project),
+                                        xilinx.expand_jobs(env))
+
 def use_proplist_scanner(node, env, path, arg=None):
     #sys.stderr.write("Calling proplist_scanner for %s\n" %(str(node)))
     #sys.stderr.write("arg: %s\n" % (str(arg)))
-    try:
-        pp = env['PROJFILE_PROPS']
-        #sys.stderr.write("PROJFILE_PROPS= %s \n" % (str(pp)))
-    except KeyError, e:
-        sys.stderr.write("...PROJFILE_PROPS not set (yet).  Must revisit!\n")
-        return []
+    # Only the project file is needed here, not its properties, so
+    # the dependencies are the same before and after they are read
     if arg is None:
         sys.stderr.write("use_proplist_scanner needs an arg!\n")
         Exit(1)
     elif arg == 'XST':
-        files=xilinx.expand_node_any((0, 'ROOT_XISE', env.subst('$PROJECTFILE')), '..') # How do we know that ".." is the root?  Just made it up!
-        #pprint.pprint(files)
-        return files
+        # Everything but constraints and ChipScope files, which XST
+        # never reads, and whatever those files include
+        files = [env.File(f) for f in expand_proj(env).synthesis_files()]
+        include_dirs = xilinx.hdl_include_dirs(env, project_path(env))
+        return files + scan_ise.hdl_dependencies(files, env, include_dirs)
     elif arg == 'coregen':
         return [] #I don't think we need to do anything smarter here -- this was just to get
     elif arg == 'ngdbuild':
-        return [] #I don't think we need to do anything smarter here -- this was just to get
+        return expand_proj(env).implement_files()
     else:
         raise ValueError("use_proplist_scanner doesn't understand arg '%s'"%(repr(arg)))
     
@@ -86,7 +113,7 @@ def generate(env):
         print "Could not find ISE in tool generate phase"
         return
 
-    get_props = Builder(action='xtclsh $XBUILDSCRIPTS/xprop_extract.tcl $SOURCE $TARGET > /dev/null 2>&1',
+    get_props = Builder(generator=generate_get_props,
                         suffix='.prop_list',
                         src_suffix='.xise')
     env.Append(BUILDERS={'GetProps': get_props})
@@ -103,18 +130,57 @@ def generate(env):
     env.Append(BUILDERS={'Bar' : bar})
 
 
+    # Read process properties out of the .xise file where we can,
+    # instead of asking xtclsh
+    env.SetDefault(XTCLSH='xtclsh')
+    env.SetDefault(XISE_NATIVE_PROPS=False)
+
+    # Run xtclsh once for the whole build, and send it every project
+    # whose properties are needed
+    env.SetDefault(XISE_PROPS_WORKER=False)
+    env.SetDefault(XTCLSH_WORKER='$XTCLSH $XBUILDSCRIPTS/xprop_extract.tcl -server')
+
     # Store standard location for properties file
     env.Replace(XISE_PY_PROPFILE=File('.scons_build_tmp/project_properties.prop_list'))
 
+    # Parsed process properties, by content; empty to always re-parse
+    env.SetDefault(XISE_PROPS_CACHE_DIR='.scons_build_tmp/props_cache')
+    env.SetDefault(XISE_PROPS_CACHE_SIZE=xparseprops.PROPS_CACHE_SIZE)
+
+    # Index of the .xise hierarchy, kept between runs so that only
+    # changed project files get read again
+    env.SetDefault(XISE_INDEX_FILE=File('.scons_build_tmp/xise_index'))
+    xil_ise.use_xise_index(env.File(env['XISE_INDEX_FILE']).abspath)
+
 
     # Set some reasonable variables
     env.Append(XISESUFFIXES=['.xise'])
+    env.SetDefault(HDLSUFFIXES=scan_ise.VERILOG_SUFFIXES + scan_ise.VHDL_SUFFIXES)
+
+    # Where Verilog `includes and VHDL packages are looked for, after
+    # the including file's directory and the project's include dirs
+    env.SetDefault(HDLINCPATH=[])
+
+    # Optionally ignore comment and whitespace edits to HDL sources
+    # when deciding what to rebuild.  Read as targets are decided, so
+    # it can be set on the environment (or a clone) at any time.
+    env.SetDefault(XISE_SEMANTIC_HDL=False)
+    env.SetDefault(XISE_SEMANTIC_SIGS_FILE=File('.scons_build_tmp/hdl_semantic_sigs'))
+    env.Decider(hdl_signature.semantic_decider())
+
+    # Threads used to read nested coregen projects (0 or 1: serially)
+    env.SetDefault(XISE_EXPAND_JOBS=0)
+
+    # Directory $PROJECTFILE is named relative to.  Empty means the
+    # top directory.
+    env.SetDefault(XISE_FSROOT='')
 
     ##
     ## Make some buiders
     ##
 
-    preconf_xst=Builder(action=xilinx.build_xst)
+    preconf_xst=Builder(action=xilinx.build_xst,
+                        emitter=depend_on_proc_props('Synthesize - XST'))
     env.Append(BUILDERS={'Preconf_xst' : preconf_xst})
 
     ## Forcibly scan for dependencies because any file mentioned in
@@ -126,10 +192,10 @@ def generate(env):
 
 
     xst = Builder(generator=xilinx.generate_xst,
-                  emitter=chain_emitters([depend_on_proj_file, depend_on_proj_props]),
+                  emitter=chain_emitters([depend_on_proj_file, depend_on_proc_props('Synthesize - XST')]),
                   src_builder=foo,
                   target_scanner=Scanner(use_proplist_scanner, argument="XST"),
-                  chdir=True, suffix=".ngc", src_suffix=".xst")
+                  suffix=".ngc", src_suffix=".xst")
     env.Append(BUILDERS={'Xst' : xst}) 
 
 
@@ -143,13 +209,13 @@ def generate(env):
     # Make some scanners
     env.Append(SCANNERS=scan_ise.XiseScannerManual())
     env.Append(SCANNERS=scan_ise.XcoScanner())
+    env.Append(SCANNERS=scan_ise.HdlScanner())
 
     ## Translate 
     ngd = Builder(generator=xilinx.generate_ngdbuild,
                   suffix='.ngd',
                   src_suffix='.ngc',
-                  chdir=True,
-                  emitter=gimme_edif,
+                  emitter=chain_emitters([gimme_edif, depend_on_proc_props('Translate')]),
                   target_scanner=Scanner(use_proplist_scanner, argument="ngdbuild"))
     env.Append(BUILDERS={'Ngd' : ngd})
 
@@ -163,14 +229,101 @@ def generate(env):
     map = Builder(generator=xilinx.generate_map,
                   suffix='.ncd',
                   src_suffix='.ngd',
-                  chdir=True)
+                  emitter=depend_on_proc_props('Map'))
     env.Append(BUILDERS={'Map' : map})
 
+    ## Block RAM contents, patched into an implemented bitstream
+    xilinx.add_data2mem(env)
+
+    # Processes to extract properties for; empty means all of them
+    env.SetDefault(XISE_PROP_PROCESSES=builder_processes(env))
+
+
+
+XPROP_EXTRACT = '$XTCLSH $XBUILDSCRIPTS/xprop_extract.tcl $SOURCE $TARGET %s > /dev/null 2>&1'
+
+# Process whose properties each builder's generator reads
+BUILDER_PROCESSES = {'Xst' : 'Synthesize - XST',
+                     'Ngd' : 'Translate',
+                     'Map' : 'Map'}
+
+def builder_processes(env):
+    """The processes read by the builders configured in env"""
+    return [BUILDER_PROCESSES[b] for b in sorted(BUILDER_PROCESSES.keys())
+            if b in env['BUILDERS']]
+
+def xprop_extract_command(processes):
+    """xprop_extract.tcl command line extracting only processes
+    (every process if empty)"""
+    return XPROP_EXTRACT % (' '.join([pipes.quote(p) for p in processes]))
+
+def extract_props(env, xise, out_file, processes):
+
+    """Dump the properties of processes (all, if empty) of the xise
+    node into out_file with xprop_extract.tcl: through the shared
+    $XTCLSH_WORKER if $XISE_PROPS_WORKER is set, otherwise with a
+    fresh xtclsh.  Returns non-zero on failure, like an action."""
+
+    if not env.get('XISE_PROPS_WORKER'):
+        return env.Execute(env.subst(xprop_extract_command(processes),
+                                     target=out_file, source=xise))
+    command = [str(a) for a in env.subst_list('$XTCLSH_WORKER')[0]]
+    try:
+        xprop_worker.get_worker(command).extract(xise.abspath, out_file.abspath, processes)
+    except xprop_worker.XpropWorkerError, e:
+        sys.stderr.write("%s\n" % (e))
+        return 1
+    return 0
+
+def worker_get_props(target, source, env):
+    return extract_props(env, source[0], target[0], env['XISE_PROP_PROCESSES'])
+
+def native_get_props(target, source, env):
+
+    """Write the property dump for the processes the build uses
+    straight from the .xise file, taking from xprop_extract.tcl only
+    the properties that can't be worked out natively."""
+
+    raw, unresolved = xprop_defaults.native_properties(str(source[0]),
+                                                       env['XISE_PROP_PROCESSES'] or None)
+    if unresolved:
+        sys.stderr.write("Asking xtclsh for properties of %s\n" % (', '.join(unresolved)))
+        dump = str(target[0]) + '.xtclsh'
+        if extract_props(env, source[0], env.File(dump), unresolved):
+            return 1
+        f = open(dump)
+        try:
+            extracted = xparseprops.process_raw(f.read())
+        finally:
+            f.close()
+        os.remove(dump)
+        raw = xprop_defaults.resolve_properties(raw, extracted)
+    f = open(str(target[0]), 'w')
+    try:
+        f.write(xparseprops.format_dump(raw) + '\n')
+    finally:
+        f.close()
+    return 0
+
+def generate_get_props(source, target, env, for_signature):
+    if env.get('XISE_NATIVE_PROPS'):
+        return Action(native_get_props, "Reading properties from $SOURCE",
+                      varlist=['XISE_PROP_PROCESSES'])
+    if env.get('XISE_PROPS_WORKER'):
+        return Action(worker_get_props, "Extracting properties of $SOURCE",
+                      varlist=['XISE_PROP_PROCESSES'])
+    return xprop_extract_command(env['XISE_PROP_PROCESSES'])
 
-    
 def interp_props(target, source, env):
     #sys.stderr.write("interp_props: %s %s %s\n"%([str(f) for f in target], [str(f) for f in source], env))
-    prop_dict = xparseprops.process(source[0].get_contents())
+    cache_dir = env.subst('$XISE_PROPS_CACHE_DIR')
+    if cache_dir:
+        prop_dict = xparseprops.process_cached(source[0].get_contents(),
+                                               env.Dir(cache_dir).abspath,
+                                               int(env['XISE_PROPS_CACHE_SIZE']))
+    else:
+        # Builders only read a few processes; parse those on demand
+        prop_dict = xparseprops.process(source[0].get_contents(), lazy=True)
     env.Replace(PROJFILE_PROPS=prop_dict)
     if env.Execute(Copy(target[0], source[0])):
         #copy failed?
@@ -1,24 +1,394 @@
 ## Library for ISE-related python functions
 
 import xml.etree.ElementTree
-from xml.etree.ElementTree import parse
 import sys, traceback
+import os
+import hashlib
+import threading
+import atexit
+import cPickle
+from collections import OrderedDict
 
 
 class XiseMissingFilesError (ValueError):
     pass
 
 
+class XiseCycleError (ValueError):
+    pass
+
+
+##
+##      Shared cache of project (.xise) contents
+##
+
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+XISE_NS = '{http://www.xilinx.com/XMLSchema}'
+
+# Maximum number of project files kept at once.  Big designs have a
+# few dozen coregen sub-projects, so this is comfortably above that.
+XISE_CACHE_SIZE = 128
+
+_xise_cache = OrderedDict()
+_xise_cache_lock = threading.Lock()
+_xise_cache_dirty = False
+
+def xise_cache_clear():
+    """Forget every cached project file"""
+    with _xise_cache_lock:
+        _xise_cache.clear()
+
+def stat_signature(path):
+    """What os.stat says about a file that changes when the file does:
+    (size, mtime, inode).  Raises OSError if there's no such file."""
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime, st.st_ino)
+
+def _file_digest(path):
+    md5 = hashlib.md5()
+    f = open(path, 'rb')
+    try:
+        for chunk in iter(lambda: f.read(65536), ''):
+            md5.update(chunk)
+    finally:
+        f.close()
+    return md5.hexdigest()
+
+
+class _HashingReader(object):
+
+    """File wrapper which hashes everything read through it, so the
+    content signature comes for free with the parse."""
+
+    def __init__(self, f):
+        self.f = f
+        self.md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.md5.update(data)
+        return data
+
+    def hexdigest(self):
+        # The parser may have stopped early; hash the rest unparsed.
+        for chunk in iter(lambda: self.f.read(65536), ''):
+            self.md5.update(chunk)
+        return self.md5.hexdigest()
+
+
+def _xise_entry(filename):
+
+    """Find (or make) the cache entry for a project file.
+
+    An entry holds whatever sections have been read so far.  It stays
+    valid while the file's size and mtime are unchanged, or, if the
+    file was merely touched, while its contents hash the same."""
+
+    path = os.path.normpath(os.path.abspath(filename))
+    try:
+        stat_sig = stat_signature(path)
+    except OSError, e:
+        # Callers have always expected IOError for a missing project file
+        raise IOError(e.errno, e.strerror, path)
+    with _xise_cache_lock:
+        entry = _xise_cache.get(path)
+    if entry is None or entry['stat'] != stat_sig:
+        digest = None
+        if entry is not None:
+            digest = _file_digest(path)
+        if entry is None or entry['digest'] != digest:
+            entry = {'digest' : digest, 'files' : None, 'props' : None, 'version' : None}
+        else:
+            entry = dict(entry)
+        entry['stat'] = stat_sig
+    with _xise_cache_lock:
+        # Re-insert so the most recently used entries are evicted last
+        _xise_cache.pop(path, None)
+        _xise_cache[path] = entry
+        while len(_xise_cache) > XISE_CACHE_SIZE:
+            _xise_cache.popitem(last=False)
+    return path, entry
+
+def _stream(path, entry, reader):
+    f = open(path, 'rb')
+    try:
+        hashing = _HashingReader(f)
+        result = reader(hashing)
+        digest = hashing.hexdigest()
+    finally:
+        f.close()
+    if entry['digest'] is not None and entry['digest'] != digest:
+        # Changed underneath us; anything read earlier is stale.
+        entry['files'] = entry['props'] = entry['version'] = None
+    entry['digest'] = digest
+    global _xise_cache_dirty
+    _xise_cache_dirty = True
+    return result
+
+def _read_files(source):
+
+    """Stream the top-level <files> section: [(name, type, [(association,
+    seqID), ...]), ...].  Stops reading at </files>."""
+
+    files = []
+    depth = 0
+    files_elem = None
+    for (event, elem) in iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 2 and elem.tag == XISE_NS + 'files':
+                files_elem = elem
+            continue
+        depth -= 1
+        if files_elem is None:
+            continue
+        if depth == 2 and elem.tag == XISE_NS + 'file':
+            associations = [(a.get(XISE_NS + 'name'), a.get(XISE_NS + 'seqID'))
+                            for a in elem.findall(XISE_NS + 'association')]
+            files.append((elem.get(XISE_NS + 'name'),
+                          elem.attrib[XISE_NS + 'type'],
+                          associations))
+            files_elem.clear()
+        elif elem is files_elem:
+            break
+    return files
+
+def _drop_element(open_elems, elem):
+    """Free an element of a section that isn't wanted, on its end
+    event.  open_elems are the elements still open, so the last of
+    them is elem's parent, whose last child elem is."""
+    elem.clear()
+    if open_elems:
+        del open_elems[-1][-1]
+
+def _read_properties(source, names=None):
+
+    """Stream the top-level <properties> section into a dictionary of
+    name -> value.  If names is given, only those are kept, and
+    reading stops once all of them have been found."""
+
+    props = {}
+    open_elems = []
+    props_elem = None
+    for (event, elem) in iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if len(open_elems) == 1 and elem.tag == XISE_NS + 'properties':
+                props_elem = elem
+            open_elems.append(elem)
+            continue
+        open_elems.pop()
+        if props_elem is None:
+            # Some other section; drop it as we go
+            _drop_element(open_elems, elem)
+            continue
+        if len(open_elems) == 2 and elem.tag == XISE_NS + 'property':
+            name = elem.get(XISE_NS + 'name')
+            if names is None or name in names:
+                props[name] = elem.get(XISE_NS + 'value')
+            props_elem.clear()
+            if names is not None and len(props) == len(names):
+                break
+        elif elem is props_elem:
+            break
+    return props
+
+##
+##      State pickled between runs
+##
+
+def read_pickle(filename):
+    """The object write_pickle stored in filename"""
+    f = open(filename, 'rb')
+    try:
+        return cPickle.load(f)
+    finally:
+        f.close()
+
+def write_pickle(filename, obj):
+
+    """Pickle obj into filename, making its directory if need be.  The
+    file is written under another name and renamed, so concurrent
+    builds never see half of it."""
+
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+    tmp_name = "%s.%d" % (filename, os.getpid())
+    try:
+        f = open(tmp_name, 'wb')
+        try:
+            cPickle.dump(obj, f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmp_name, filename)
+    except:
+        try:
+            os.remove(tmp_name)
+        except OSError:
+            pass
+        raise
+
+def load_state(filename, version, what):
+
+    """The state save_state stored in filename with this version, or
+    None.  A missing file or one of another version is simply None; an
+    unreadable one is reported, as what, and is None too."""
+
+    try:
+        saved = read_pickle(filename)
+    except IOError:
+        return None
+    except Exception, e:
+        sys.stderr.write("Ignoring unreadable %s %s: %s\n" % (what, filename, str(e)))
+        return None
+    if not isinstance(saved, tuple) or len(saved) != 2 or saved[0] != version:
+        return None
+    return saved[1]
+
+def save_state(filename, version, state):
+    """Store state in filename for load_state"""
+    write_pickle(filename, (version, state))
+
+def saved_at_exit(what, load, save):
+
+    """Return a function use(filename) which calls load(filename) now,
+    and save(filename) when SCons exits.  Using the same file again
+    does nothing; using another makes that the one saved.  The build
+    is over by the time of saving, so a failure to save is reported,
+    as what, rather than raised."""
+
+    used = [None]
+
+    def save_at_exit():
+        try:
+            save(used[0])
+        except (IOError, OSError), e:
+            sys.stderr.write("Unable to save %s %s: %s\n" % (what, used[0], str(e)))
+
+    def use(filename):
+        filename = os.path.abspath(filename)
+        if used[0] == filename:
+            return
+        if used[0] is None:
+            atexit.register(save_at_exit)
+        used[0] = filename
+        load(filename)
+
+    return use
+
+##
+##      Persistent index of project contents, so that a later run only
+##      re-reads the projects that changed
+##
+
+XISE_INDEX_VERSION = 1
+
+def load_xise_index(filename):
+
+    """Seed the project cache from an index written by save_xise_index.
+    Entries are still checked against each file's stat/content
+    signature before use, so a stale index costs a re-read, never a
+    wrong answer.  A missing or unreadable index is ignored."""
+
+    entries = load_state(filename, XISE_INDEX_VERSION, 'project index')
+    if entries is None:
+        return
+    with _xise_cache_lock:
+        for (path, entry) in entries:
+            if path not in _xise_cache and len(_xise_cache) < XISE_CACHE_SIZE:
+                _xise_cache[path] = entry
+
+def save_xise_index(filename):
+
+    """Write every cached project section to filename, if anything new
+    was read since the index was loaded."""
+
+    global _xise_cache_dirty
+    with _xise_cache_lock:
+        if not _xise_cache_dirty:
+            return
+        entries = [(path, entry) for (path, entry) in _xise_cache.items()
+                   if entry['digest'] is not None and
+                   (entry['files'] is not None or entry['props'] is not None or
+                    entry.get('version') is not None)]
+        _xise_cache_dirty = False
+    save_state(filename, XISE_INDEX_VERSION, entries)
+
+# use_xise_index(filename): load the project index in filename now,
+# and save it back when SCons exits
+use_xise_index = saved_at_exit('project index', load_xise_index, save_xise_index)
+
+def _read_version(source):
+
+    """Stream to the top-level <version> element and return the ISE
+    version that last wrote the project (e.g. '13.2'), or ''"""
+
+    open_elems = []
+    for (event, elem) in iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            open_elems.append(elem)
+            continue
+        open_elems.pop()
+        if len(open_elems) == 1 and elem.tag == XISE_NS + 'version':
+            return elem.get(XISE_NS + 'ise_version', '')
+        _drop_element(open_elems, elem)
+    return ''
+
+def get_project_file_entries(filename):
+
+    """Return [(name, type, [(association, seqID), ...]), ...] for
+    every file listed in a .xise project, in file order.  The result is
+    cached and shared, so callers must not modify it."""
+
+    path, entry = _xise_entry(filename)
+    if entry['files'] is None:
+        entry['files'] = _stream(path, entry, _read_files)
+    return entry['files']
+
+def get_project_props(filename, names=None):
+
+    """Return a dictionary of the project-level properties stored in a
+    .xise file.  If names is given, only those properties are looked
+    up.  Missing properties are simply absent from the result."""
+
+    path, entry = _xise_entry(filename)
+    if entry['props'] is not None:
+        props = entry['props']
+    elif names is None:
+        props = entry['props'] = _stream(path, entry, _read_properties)
+    else:
+        return _stream(path, entry, lambda source: _read_properties(source, set(names)))
+    if names is None:
+        return dict(props)
+    return dict([(n, props[n]) for n in names if n in props])
+
+def get_project_ise_version(filename):
+    """The ISE version recorded in a .xise file, e.g. '13.2'"""
+    path, entry = _xise_entry(filename)
+    if entry.get('version') is None:
+        entry['version'] = _stream(path, entry, _read_version)
+    return entry['version']
+
+def get_xise_digest(filename):
+    """Content signature (MD5 hex digest) of a .xise file"""
+    path, entry = _xise_entry(filename)
+    if entry['digest'] is None:
+        entry['digest'] = _file_digest(path)
+    return entry['digest']
+
+
 def get_project_files(filename, filetype=None, minfiles=0):
 
     """Parse Xilinx .xise file and extract source files having type
     <filetype>.  No path normalization is done here."""
-    
-    tree = parse(filename)    
-    root = tree.getroot()
-    files = root.find('{http://www.xilinx.com/XMLSchema}files')
-    properties = root.find('{http://www.xilinx.com/XMLSchema}properties')
-
 
     # Find chipscope files
     if filetype is None:
@@ -26,9 +396,9 @@ def get_project_files(filename, filetype=None, minfiles=0):
     else:
         matchFun = lambda ft: (ft == filetype)
         
-    matchingFiles = [f.get('{http://www.xilinx.com/XMLSchema}name')
-                     for f in files.findall('{http://www.xilinx.com/XMLSchema}file')
-                     if matchFun(f.attrib['{http://www.xilinx.com/XMLSchema}type'])]
+    matchingFiles = [f_name
+                     for (f_name, f_type, associations) in get_project_file_entries(filename)
+                     if matchFun(f_type)]
 
     if len(matchingFiles) < minfiles:
         msg = "Required at least {0:d} files of type {1}, found only {2:d}: {3} ".format(minfiles, filetype, len(matchingFiles), matchingFiles)
@@ -63,14 +433,42 @@ def process_opt_with_defn(process, key, defns, values):
                    value=value)
     return args
 
+## Generators translate the same options every time SCons computes a
+## signature, so translations are remembered by (process, options).
+## Callers get their own copy of the argument lists.
+
+_opts_memo = {}
+_opts_memo_lock = threading.Lock()
+
+def _memo_key(process, opt_dict):
+    # With the types: True == 1 == 1.0, but they translate differently
+    return (process, frozenset([(k, type(v), v) for (k, v) in opt_dict.items()]))
+
+def _copy_args(args):
+    return [list(a) for a in args]
+
+def _memoized_opts(process, opt_dict, translate):
+    key = _memo_key(process, opt_dict)
+    with _opts_memo_lock:
+        args = _opts_memo.get(key)
+    if args is None:
+        args = translate(opt_dict)
+        with _opts_memo_lock:
+            _opts_memo[key] = args
+    return args
+
 def process_xst_opts(opt_dict):
 
     """Go through user/project specified option preferences (opt_dict)
     and build up XST command-line arguments for 'set' and 'run' """
-    
+
+    (set_args, run_args) = _memoized_opts('xst', opt_dict, _process_xst_opts)
+    return (_copy_args(set_args), _copy_args(run_args))
+
+def _process_xst_opts(opt_dict):
     set_args = []
     run_args = []
-    for k in opt_dict.keys():
+    for k in sorted(opt_dict.keys()):
         if k in XST_RUN_OPTS:
             #print "RUN %s\t%s\t%s" % (k,XST_RUN_OPTS[k],opt_dict[k])
             args = process_opt_with_defn('xst',k, XST_RUN_OPTS, opt_dict)
@@ -135,7 +533,8 @@ def process_ngd_opts(opt_dict):
     """Go through user/project specified option preferences (opt_dict)
     and build up ngdbuild command-line arguments"""
 
-    return process_tool_opts('ngd', NGDBUILD_OPTS, opt_dict)
+    return _copy_args(_memoized_opts('ngd', opt_dict,
+                                     lambda opts: process_tool_opts('ngd', NGDBUILD_OPTS, opts)))
 
 
 def process_map_opts(opt_dict):
@@ -143,6 +542,9 @@ def process_map_opts(opt_dict):
     """Go through user/project specified option preferences (opt_dict)
     and build up ma command-line arguments"""
 
+    return _copy_args(_memoized_opts('map', opt_dict, _process_map_opts))
+
+def _process_map_opts(opt_dict):
     try:
         opts=global_preprocess_opts(opt_dict)
         return process_tool_opts('map', MAP_OPTS, opts)
@@ -161,7 +563,8 @@ def process_tool_opts(process, defn_dict, opt_dict):
     
     all_args = []
 
-    for k in opt_dict.keys():
+    # Sorted, so that the command line doesn't depend on dict order
+    for k in sorted(opt_dict.keys()):
         if k in defn_dict:
             #print "RUN %s\t%s\t%s" % (k,defn_dict[k],opt_dict[k])
             try:
@@ -8,13 +8,23 @@ import platform
 import operator
 import pprint
 import os.path
-import itertools
+import re
+import hashlib
+import pipes
+import SCons.Util
+import multiprocessing.pool
 import xml.etree.ElementTree
-from xml.etree.ElementTree import parse
 from xil_ise import get_project_files
+from xil_ise import get_project_file_entries
+from xil_ise import get_project_props
+from xil_ise import get_xise_digest
+from xil_ise import stat_signature
+from xil_ise import use_xise_index
+from xil_ise import XiseCycleError
 from xil_ise import process_xst_opts
 from xil_ise import process_ngd_opts
 from xil_ise import process_map_opts
+import xparseprops
 #from xil_ise import get_project_prop
 
 def seq_dedup(seq):
@@ -27,16 +37,9 @@ def get_impl_files(project_file):
 
     "Extract all files mentioned in XISE project file with an Implementation association"
     
-    tree = parse(project_file)
-    root = tree.getroot()
-    files = root.find('{http://www.xilinx.com/XMLSchema}files')
     impl_files = []
-    for f in files.findall('{http://www.xilinx.com/XMLSchema}file'):
-        f_name = f.get('{http://www.xilinx.com/XMLSchema}name')
-        f_type = f.attrib['{http://www.xilinx.com/XMLSchema}type']
-        for a in f.findall('./{http://www.xilinx.com/XMLSchema}association'):
-            a_name = a.get('{http://www.xilinx.com/XMLSchema}name')
-            a_seqid = a.get('{http://www.xilinx.com/XMLSchema}seqID')
+    for (f_name, f_type, associations) in get_project_file_entries(project_file):
+        for (a_name, a_seqid) in associations:
             if a_name == 'Implementation':
                 impl_files.append((int(a_seqid), f_type, f_name))
                 continue
@@ -44,48 +47,257 @@ def get_impl_files(project_file):
     impl_files.sort(key=operator.itemgetter(0))
     return impl_files
 
-def expand_node(n, fsroot, term_test, verbose=False):
+# File types which are themselves projects, and are expanded in place
+PROJECT_FILE_TYPES = ['ROOT_XISE', 'FILE_COREGENISE']
+
+RTL_FILE_TYPES = ['FILE_VERILOG', 'FILE_VHDL']
+
+# File types XST never reads: constraints and ChipScope definitions
+# are first used by the core inserter and ngdbuild
+IMPLEMENT_FILE_TYPES = ['FILE_UCF', 'FILE_CDC']
+
+class ExpandedProject(object):
+
+    """Every file reachable from a project node, in the order
+    expand_node has always produced them (each project first, then
+    its own files in seqID order, recursing into sub-projects).  Files
+    are also grouped by type, so that asking for one category does
+    not need another walk of the tree."""
+
+    def __init__(self, nodes, projects=()):
+        self.nodes = nodes              # [(file_type, path), ...]
+        self.projects = list(projects)  # normalized paths of every project read
+        self.signature = None           # see expand_project_cached
+        self._sub_files = None
+        self._synthesis_files = None
+        self.by_type = {}
+        for (file_type, path) in nodes:
+            self.by_type.setdefault(file_type, []).append(path)
+
+    def files(self, term_test):
+        """All paths whose type satisfies term_test(file_type)"""
+        return [path for (file_type, path) in self.nodes if term_test(file_type)]
+
+    def sub_files(self):
+        """All paths except the root project's own (computed once)"""
+        if self._sub_files is None:
+            self._sub_files = [path for (file_type, path) in self.nodes
+                               if file_type != 'ROOT_XISE']
+        return self._sub_files
+
+    def synthesis_files(self):
+        """sub_files(), less those only used after synthesis (computed once)"""
+        if self._synthesis_files is None:
+            self._synthesis_files = [path for (file_type, path) in self.nodes
+                                     if file_type != 'ROOT_XISE'
+                                     and file_type not in IMPLEMENT_FILE_TYPES]
+        return self._synthesis_files
+
+    def implement_files(self):
+        """Files first used by the core inserter or ngdbuild"""
+        return self.of_type(*IMPLEMENT_FILE_TYPES)
+
+    def of_type(self, *file_types):
+        """All paths having one of the given types"""
+        if len(file_types) == 1:
+            return list(self.by_type.get(file_types[0], []))
+        return [path for (file_type, path) in self.nodes if file_type in file_types]
+
+
+def _project_key(file_name):
+    return os.path.normpath(os.path.abspath(file_name))
+
+def _read_sub_files(file_name):
+    try:
+        raw = get_impl_files(file_name)
+    except IOError, e:
+        #  Usually means file is missing?
+        sys.stderr.write("Unable to expand file -- perhaps it's not there (yet): %s\n" % (str(e)))
+        raw = []
+    return [f for f in raw if f is not None]
+
+def _extend_sub_nodes(nodes, sub_nodes, file_name):
+    sub_root = os.path.dirname(file_name)
+    nodes.extend([(file_type, os.path.join(sub_root, path))
+                  for (file_type, path) in sub_nodes])
+
+def _prefetch_sub_projects(file_name):
+    try:
+        raw = get_impl_files(file_name)
+    except IOError:
+        # expand_dag will complain about it
+        return []
+    return [os.path.join(os.path.dirname(file_name), f_name)
+            for (seq_no, f_type, f_name) in raw
+            if f_type in PROJECT_FILE_TYPES]
+
+def prefetch_projects(file_name, jobs):
+
+    """Read every project below file_name into the project cache,
+    parsing sibling sub-projects concurrently on a pool of at most
+    'jobs' threads.  This is worthwhile where opening files is slow
+    (e.g. NFS); the expansion proper then only hits the cache."""
+
+    pool = multiprocessing.pool.ThreadPool(jobs)
+    try:
+        seen = set([_project_key(file_name)])
+        frontier = [file_name]
+        while frontier:
+            next_frontier = []
+            for sub_names in pool.map(_prefetch_sub_projects, frontier):
+                for sub_name in sub_names:
+                    sub_key = _project_key(sub_name)
+                    if sub_key not in seen:
+                        seen.add(sub_key)
+                        next_frontier.append(sub_name)
+            frontier = next_frontier
+    finally:
+        pool.close()
+        pool.join()
+
+def expand_jobs(env):
+    """Number of threads to expand projects with, from $XISE_EXPAND_JOBS"""
+    return int(env.get('XISE_EXPAND_JOBS', 0) or 0)
+
+def expand_dag(file_name, verbose=False, jobs=0, projects=None):
+
+    """Find every file below the project file_name, as (file_type,
+    path) pairs with paths relative to that project's directory.
+
+    Projects are treated as a DAG keyed by normalized path: a
+    sub-project reachable from several parents is read and expanded
+    only once, although it still appears under each parent in the
+    result.  The walk uses an explicit stack rather than recursion,
+    and raises XiseCycleError if a project (indirectly) includes
+    itself.
+
+    If jobs > 1, sub-projects are first read concurrently (see
+    prefetch_projects); the result is the same either way.  If
+    projects is a list, the normalized path of every project file
+    visited (including missing ones) is appended to it."""
+
+    if jobs > 1:
+        prefetch_projects(file_name, jobs)
+    memo = {}
+    # Each frame: [key, file_name, iterator over sub files, nodes, pending sub-project]
+    stack = [[_project_key(file_name), file_name,
+              iter(_read_sub_files(file_name)), [], None]]
+    on_stack = set([stack[0][0]])
+    while stack:
+        frame = stack[-1]
+        key, name, sub_files, nodes = frame[:4]
+        descend = None
+        for (seq_no, file_type, sub_name) in sub_files:
+            nodes.append((file_type, sub_name))
+            if file_type not in PROJECT_FILE_TYPES:
+                continue
+            # Named relative to the project that contains it
+            sub_path = os.path.join(os.path.dirname(name), sub_name)
+            sub_key = _project_key(sub_path)
+            if sub_key in on_stack:
+                cycle = [f[1] for f in stack] + [sub_path]
+                raise XiseCycleError("Project files include each other: " + ' -> '.join(cycle))
+            if sub_key in memo:
+                _extend_sub_nodes(nodes, memo[sub_key], sub_name)
+            else:
+                descend = (sub_key, sub_name, sub_path)
+                break
+        if descend is not None:
+            sub_key, sub_name, sub_path = descend
+            if verbose:
+                print sub_path
+                print os.path.dirname(sub_path)
+            frame[4] = sub_name
+            stack.append([sub_key, sub_path, iter(_read_sub_files(sub_path)), [], None])
+            on_stack.add(sub_key)
+            continue
+        # Finished this project; hand its files to the parent
+        stack.pop()
+        on_stack.discard(key)
+        memo[key] = nodes
+        if stack:
+            parent = stack[-1]
+            _extend_sub_nodes(parent[3], nodes, parent[4])
+            parent[4] = None
+    if projects is not None:
+        projects.extend(memo.keys())
+    return memo[_project_key(file_name)]
+
+def expand_project(n, fsroot, verbose=False, jobs=0):
+
+    """Walk the project tree under node n exactly once, recursing on
+    FILE_COREGENISE files, and return an ExpandedProject holding
+    every file found.  n itself is included (usually as ROOT_XISE).
+    See expand_dag for 'jobs'."""
 
-    """Recursively find files we know what to do with.  Specifically,
-    we recurse on FILE_COREGENISE files, and return a leaf node for
-    files for which term_test(file_type) is true."""
-    
     seq_no, file_type, file_name = n
-    if term_test(file_type):
-        this_node = [os.path.join(fsroot, file_name)]
-    else:
-        this_node = None 
-    if file_type in ['ROOT_XISE','FILE_COREGENISE']:
+    nodes = [(file_type, os.path.join(fsroot, file_name))]
+    projects = []
+    if file_type in PROJECT_FILE_TYPES:
         new_fs_root = os.path.join(fsroot, os.path.dirname(file_name))
         if verbose:
-            print file_name                
+            print file_name
             print new_fs_root
+        nodes.extend([(sub_type, os.path.join(new_fs_root, path))
+                      for (sub_type, path) in expand_dag(file_name, verbose, jobs, projects)])
+    return ExpandedProject(nodes, projects)
+
+def project_signature(projects):
+    """Content signatures of a list of project files (None if missing)"""
+    sig = []
+    for path in projects:
         try:
-            raw = get_impl_files(file_name)
-        except IOError, e:
-            #  Usually means file is missing?
-            sys.stderr.write("Unable to expand file -- perhaps it's not there (yet): %s\n" % (str(e)))
-            raw = []
-        #pprint.pprint(raw)
-        sub_files = [f for f in raw if f is not None]
-        expanded =[this_node] + [expand_node(f, new_fs_root, term_test) for f in sub_files]
-        filtered=[n for n in expanded if n is not None]
-        return list(itertools.chain.from_iterable(filtered))
-    else:
-        return this_node
+            sig.append((path, get_xise_digest(path)))
+        except IOError:
+            sig.append((path, None))
+    return tuple(sig)
 
-def expand_node_rtl(n, fsroot):
-    def is_rtl(filetype):
-        return filetype in ['FILE_VERILOG', 'FILE_VHDL']
-    return expand_node(n, fsroot, is_rtl)
+_expansion_cache = {}
 
-def expand_node_any(n, fsroot):
-    def no_root(filetype):
-        return filetype != 'ROOT_XISE'
-    return expand_node(n, fsroot, no_root)
+def expand_project_cached(project_file, fsroot, jobs=0, file_type='ROOT_XISE'):
+
+    """expand_project for a project file, reused for as long as no
+    project file in its hierarchy changes.  Checking that costs a stat
+    per project file; the tree is not walked again."""
+
+    key = (_project_key(project_file), fsroot, file_type)
+    expanded = _expansion_cache.get(key)
+    if expanded is not None and project_signature(expanded.projects) == expanded.signature:
+        return expanded
+    expanded = expand_project((0, file_type, project_file), fsroot, jobs=jobs)
+    expanded.signature = project_signature(expanded.projects)
+    _expansion_cache[key] = expanded
+    return expanded
+
+def expand_node(n, fsroot, term_test, verbose=False, jobs=0):
+
+    """Recursively find files we know what to do with.  Specifically,
+    we recurse on FILE_COREGENISE files, and return a leaf node for
+    files for which term_test(file_type) is true."""
+
+    seq_no, file_type, file_name = n
+    if file_type not in PROJECT_FILE_TYPES:
+        if term_test(file_type):
+            return [os.path.join(fsroot, file_name)]
+        return None
+    if verbose:
+        return expand_project(n, fsroot, verbose, jobs).files(term_test)
+    return expand_node_cached(n, fsroot, jobs).files(term_test)
+
+def expand_node_cached(n, fsroot, jobs=0):
+    """expand_project_cached for project node n"""
+    seq_no, file_type, file_name = n
+    return expand_project_cached(file_name, fsroot, jobs, file_type)
+
+def expand_node_rtl(n, fsroot, jobs=0):
+    return expand_node_cached(n, fsroot, jobs).of_type(*RTL_FILE_TYPES)
+
+def expand_node_any(n, fsroot, jobs=0):
+    return list(expand_node_cached(n, fsroot, jobs).sub_files())
 
 def generate_extradeps_from_prj (target, source, env, test):
-    extrafiles = expand_node((0, 'ROOT_XISE', env.subst('$PROJECTFILE')), '.', test)
+    extrafiles = expand_node((0, 'ROOT_XISE', env.subst('$PROJECTFILE')), '.', test,
+                             jobs=expand_jobs(env))
     return target, source+extrafiles
 
 def generate_deps_all_cgise (target, source, env):    
@@ -113,10 +325,6 @@ def process_project_file (context, pfile):
     print "Expanding project file paths relative to PWD="+topdir
     context.env['TOPDIR']=topdir
 
-    tree = parse(pfile)
-    root = tree.getroot()
-    props = root.find('{http://www.xilinx.com/XMLSchema}properties')
-
     # Find chipscope files
     chipscopes = get_project_files(pfile, "FILE_CDC",0)
     if len(chipscopes) > 1:
@@ -136,9 +344,7 @@ def process_project_file (context, pfile):
 
 
     #Find properties
-    prop_dict = {}
-    for p in props.findall('{http://www.xilinx.com/XMLSchema}property'):
-        prop_dict[p.get('{http://www.xilinx.com/XMLSchema}name')]=p.get('{http://www.xilinx.com/XMLSchema}value')
+    prop_dict = get_project_props(pfile)
 
     #Part number
     device  = prop_dict['Device']
@@ -160,14 +366,124 @@ def process_project_file (context, pfile):
     #Include dirs
     include_dirs = prop_dict["Verilog Include Directories"]
     context.env['INCLUDE_DIRS'] = include_dirs
+    context.env.AppendUnique(HDLINCPATH=hdl_include_dirs(context.env, pfile))
 
     context.env['gp'] = prop_dict["Generics, Parameters"]
 
 
+def split_include_dirs(value):
+    """Directories in a 'Verilog Include Directories' value, which
+    ISE separates with '|' (spaces also accepted)"""
+    if not value:
+        return []
+    return [d for d in re.split(r'[|\s]+', str(value)) if d != '']
+
+def hdl_include_dirs(env, project):
+
+    """Directories Verilog `includes are searched in: the project's
+    'Verilog Include Directories', plus XST's setting of the same name
+    if the properties file has been built.  Relative directories are
+    taken relative to the project."""
+
+    root = os.path.dirname(os.path.abspath(project))
+    values = [get_project_props(project, ['Verilog Include Directories']).get('Verilog Include Directories')]
+    try:
+        values.append(process_props(env, 'Synthesize - XST').get('Verilog Include Directories'))
+    except KeyError:
+        pass
+    dirs = []
+    for value in values:
+        dirs.extend([os.path.normpath(os.path.join(root, d)) for d in split_include_dirs(value)])
+    return seq_dedup(dirs)
+
 #
 # Step 0:  Generate the FOO.xst and FOO.prj files which will guide XST.
 #
 
+##
+## Process properties, as seen by builders and generators.  They come
+## from $XISE_PY_PROPFILE on disk whenever it exists, so a generator
+## returns the same command line when SCons computes a signature as
+## when the target is built, in this run or the next.  Each version of
+## the file is parsed once.
+##
+
+_props_files = {}
+
+def _read_props_file(env, path):
+    stat_sig = stat_signature(path)
+    cached = _props_files.get(path)
+    if cached is not None and cached[0] == stat_sig:
+        return cached[1]
+    f = open(path)
+    try:
+        contents = f.read()
+    finally:
+        f.close()
+    cache_dir = env.subst('$XISE_PROPS_CACHE_DIR')
+    if cache_dir:
+        props = xparseprops.process_cached(contents, env.Dir(cache_dir).abspath,
+                                           int(env['XISE_PROPS_CACHE_SIZE']))
+    else:
+        props = xparseprops.process(contents, lazy=True)
+    _props_files[path] = (stat_sig, props)
+    return props
+
+def process_props(env, process):
+
+    """The properties of process, from $XISE_PY_PROPFILE if it has
+    been built, otherwise from $PROJFILE_PROPS.  Raises KeyError if
+    neither has them."""
+
+    if 'XISE_PY_PROPFILE' in env:
+        path = env.File(env['XISE_PY_PROPFILE']).abspath
+        if os.path.exists(path):
+            return _read_props_file(env, path)[process]
+    return env['PROJFILE_PROPS'][process]
+
+
+##
+## Per-process property sections.  Each stage depends on a file holding
+## just its own process's section of $XISE_PY_PROPFILE, so editing,
+## say, a bitgen property only rebuilds what bitgen produces.
+##
+
+def write_prop_section(target, source, env):
+    """Copy one process's section out of a property dump"""
+    processes = xparseprops.LazyProcesses(source[0].get_contents())
+    try:
+        text = processes.section_text(env['XISE_PROP_SECTION'])
+    except KeyError:
+        text = ''
+    f = open(str(target[0]), 'w')
+    try:
+        f.write(text + '\n')
+    finally:
+        f.close()
+    return 0
+
+_prop_sections = {}
+
+def prop_section(env, process):
+
+    """The node holding the section of $XISE_PY_PROPFILE for process,
+    next to it: FOO.prop_list gets FOO.<process>.prop_section.  The
+    node is only set up once, however many targets depend on it."""
+
+    propfile = env.File(env['XISE_PY_PROPFILE'])
+    name = '%s.%s.prop_section' % (os.path.splitext(propfile.name)[0],
+                                   re.sub(r'[^A-Za-z0-9]+', '_', process).strip('_'))
+    section = propfile.dir.File(name)
+    key = section.abspath
+    if key not in _prop_sections:
+        _prop_sections[key] = env.Command(section, propfile,
+                                          Action(write_prop_section,
+                                                 "Extracting '%s' properties" % (process),
+                                                 varlist=['XISE_PROP_SECTION']),
+                                          XISE_PROP_SECTION=process)[0]
+    return _prop_sections[key]
+
+
 def build_xst (target, source, env):
 
     """Create .xst file, which contains the full command line for xst,
@@ -182,12 +498,17 @@ def build_xst (target, source, env):
     coregen_dir_fmt = "{"+' '.join(coregen_dirs)+" }"
 
     try:
-        options=env['PROJFILE_PROPS']['Synthesize - XST']
+        # A copy: it gets adjusted below
+        options=dict(process_props(env, 'Synthesize - XST'))
     except KeyError, e:
         sys.stderr.write("Error getting synthesis options: %s\n" % (str(e)))
         Exit(1)
     pprint.pprint(options)
 
+    # Per-variant generics replace the project's
+    if env.get('XST_GENERICS') is not None:
+        options['Generics, Parameters'] = env['XST_GENERICS']
+
     ## XXX HACK!
     if options['Cores Search Directories'] is None:
         options['Cores Search Directories'] = ' '.join(coregen_dirs)
@@ -219,6 +540,11 @@ def build_xst (target, source, env):
     return 0
 
 
+def build_xst_and_prj (target, source, env):
+    """Create both the .xst file (target[0]) and the .prj file (target[1])"""
+    return (build_xst(target[:1], source, env) or
+            build_prj(target[1:], source, env))
+
 def build_prj (target, source, env):
 
     """Create .prj file, which contains a list of files involved"""
@@ -226,7 +552,7 @@ def build_prj (target, source, env):
     prj_filename = str(target[0])
 
     
-    impl_files = expand_node_rtl((0, 'ROOT_XISE', str(source[0])), '.')
+    impl_files = expand_node_rtl((0, 'ROOT_XISE', str(source[0])), '.', expand_jobs(env))
     
     outfile = open(prj_filename,"w")
     for vfile in [os.path.abspath(f) for f in impl_files]:
@@ -237,12 +563,9 @@ def build_prj (target, source, env):
 
 def identify_coregens(env):
     prj_filename = env.subst('$PROJECTFILE')
-    def is_xco (filetype):
-        return filetype=='FILE_COREGEN'
-    def is_cgise (filetype):
-        return filetype=='FILE_COREGENISE'    
-    coregen_xcos = expand_node((0, 'ROOT_XISE', prj_filename), '.', is_xco)
-    coregen_xises = expand_node((0, 'ROOT_XISE', prj_filename), '.', is_cgise)
+    expanded = expand_project_cached(prj_filename, '.', expand_jobs(env))
+    coregen_xcos = expanded.of_type('FILE_COREGEN')
+    coregen_xises = expanded.of_type('FILE_COREGENISE')
 
     # Naive -- not always true!
     xco_of = [(f, os.path.splitext(f)[0]+'.xco') for f in coregen_xises]
@@ -258,6 +581,28 @@ def generate_coregen (source, target, env, for_signature):
     # Assumed! that target is correct
     return cmd_line
     
+##
+## Tool commands run in their target's directory, and name their
+## files relative to it.  The directory change is part of the command
+## rather than a builder chdir, so several builds can run at once
+## under -j; it is left out of signatures.
+##
+
+def target_rel(node, target):
+    """Path of node relative to the directory of target"""
+    return os.path.relpath(os.path.abspath(str(node)), os.path.dirname(os.path.abspath(str(target))))
+
+def in_target_dir(cmd_line, target, for_signature):
+    if for_signature:
+        return cmd_line
+    return 'cd %s && %s' % (pipes.quote(os.path.dirname(os.path.abspath(str(target)))), cmd_line)
+
+def coregen_search_dir(env, target_dir):
+    """ngdbuild's -sd: $COREGEN_DIR relative to target_dir"""
+    if env.get('COREGEN_DIR'):
+        return os.path.relpath(env.Dir(env['COREGEN_DIR']).abspath, target_dir.abspath)
+    return '../../coregen' # XXX bad!  Get this path somewhere reasonable!
+
 #
 # Step 1: First "real" step: .xst script (+source files) -> .ngc, .ngr, log file (.srp)
 #
@@ -268,22 +613,25 @@ def generate_xst (source, target, env, for_signature):
     command line stored in FOO.xst).  Expect the following sources
     [0]=.xst file"""
 
-    xst_filename = os.path.basename(str(source[0]))
+    xst_filename = target_rel(source[0], target[0])
     syr_filename = os.path.splitext(xst_filename)[0]+'.syr'
     cmd_line = 'xst -intstyle {0} -ifn {1} -ofn {2}'
     cmd_line = cmd_line.format(env.subst('$INTSTYLE'),
                                xst_filename,
                                syr_filename)
                 
-    return cmd_line
+    return in_target_dir(cmd_line, target[0], for_signature)
 
 def source_files_from_xise (target, source, env):
-    files = expand_node_any((0, 'ROOT_XISE', str(source[0])), '.')
+    # Constraint and ChipScope files are left to the later stages
+    files = list(expand_project_cached(str(source[0]), '.',
+                                       expand_jobs(env)).synthesis_files())
     #pprint.pprint(files)
-    return target, source+[os.path.join(env.subst('$WORK_DIR'),
-                                        env.subst('$FILE_STEM') + '.xst'),
-                           os.path.join(env.subst('$WORK_DIR'),
-                                        env.subst('$FILE_STEM') + '.prj')]+files
+    # The .xst script goes first: it's what generate_xst runs XST on
+    return target, [os.path.join(env.subst('$WORK_DIR'),
+                                 env.subst('$FILE_STEM') + '.xst'),
+                    os.path.join(env.subst('$WORK_DIR'),
+                                 env.subst('$FILE_STEM') + '.prj')]+source+files
 
 #
 # Step 2: Translate
@@ -311,42 +659,39 @@ def generate_chipsope_insert (source, target, env, for_signature):
                                env.subst('$CHIPSCOPE_FILE'), # 3
                                env.subst('$UCF'),            # 4
                                env.subst('$PARTNUM'),        # 5
-                               os.path.basename(str(source[0])), # 6
-                               os.path.basename(str(target[0]))) # 7
-    return cmd_line
+                               target_rel(source[0], target[0]), # 6
+                               target_rel(target[0], target[0])) # 7
+    return in_target_dir(cmd_line, target[0], for_signature)
 
 #2.2 Regular ngdbuild
 def generate_ngdbuild (source, target, env, for_signature):
 
     try:
-        options=env['PROJFILE_PROPS']['Translate']
-        #pprint.pprint(options)
+        options=process_props(env, 'Translate')
         opt_args = process_ngd_opts(options)
-        #pprint.pprint(args)
     except KeyError, e:
         if not for_signature:
             sys.stderr.write("Error getting Translate / ngdbuild options: %s\n" % (str(e)))
             Exit(1)
-        else:
-            sys.stderr.write("generate_ngdbuild called before PROJFILE_PROPS was defined. That's OK as long as it gets called again later.\n")
-            opt_args = []
+        # The properties file hasn't been built, so neither has the target
+        opt_args = []
 
     initial_args = ['ngdbuild',
                     '-quiet',
                     '-intstyle', env.subst('$INTSTYLE'),
-                    '-sd', '../../coregen', # XXX bad!  Get this path somewhere reasonable!
+                    '-sd', coregen_search_dir(env, target[0].dir),
                     '-uc', env.subst('$UCF'),
                     '-p', env.subst('$PARTNUM')]
                 
     
     flat_args = [item for sublist in opt_args for item in sublist]
     
-    args = initial_args + flat_args + [os.path.basename(str(source[0])),
-                                       os.path.basename(str(target[0]))]
+    args = initial_args + flat_args + [target_rel(source[0], target[0]),
+                                       target_rel(target[0], target[0])]
     #pprint.pprint(all_args)
 
     cmd_line=' '.join(args) + ' >/dev/null'
-    return cmd_line
+    return in_target_dir(cmd_line, target[0], for_signature)
 
 
 #
@@ -354,17 +699,14 @@ def generate_ngdbuild (source, target, env, for_signature):
 #
 def generate_map (source, target, env, for_signature):
     try:
-        options=env['PROJFILE_PROPS']['Map']
-        pprint.pprint(options)
-        opt_args = process_map_opts(options)        
-        pprint.pprint(opt_args)
+        options=process_props(env, 'Map')
+        opt_args = process_map_opts(options)
     except KeyError, e:
         if not for_signature:
             sys.stderr.write("Error getting Map options: %s\n" % (str(e)))
             Exit(1)
-        else:
-            sys.stderr.write("generate_map called before PROJFILE_PROPS was defined. That's OK as long as it gets called again later.\n")
-            opt_args = []
+        # The properties file hasn't been built, so neither has the target
+        opt_args = []
 
 
     initial_args = ['map',
@@ -377,12 +719,12 @@ def generate_map (source, target, env, for_signature):
 
     #pprint.pprint(flat_args)
     
-    args = initial_args + flat_args + ['-o', os.path.basename(str(target[0])), # NCD file
-                                       os.path.basename(str(source[0])), #NGD file
-                                       os.path.basename(str(target[1])),  # PCF file
+    args = initial_args + flat_args + ['-o', target_rel(target[0], target[0]), # NCD file
+                                       target_rel(source[0], target[0]), #NGD file
+                                       target_rel(target[1], target[0]),  # PCF file
                                        ]
     cmd_line=' '.join(args)
-    return cmd_line                               
+    return in_target_dir(cmd_line, target[0], for_signature)
                                
     return cmd_line
     
@@ -393,10 +735,10 @@ def generate_map (source, target, env, for_signature):
 def generate_par (source, target, env, for_signature):
     cmd_line = "par -w -intstyle {0} -ol high -t 1 {1} {2} {3}"
     cmd_line = cmd_line.format(env.subst('$INTSTYLE'),
-                               os.path.basename(str(source[0])),     # in
-                               os.path.basename(str(target[0])),     # out
-                               os.path.basename(str(source[1])))     # constraint  (in)
-    return cmd_line
+                               target_rel(source[0], target[0]),     # in
+                               target_rel(target[0], target[0]),     # out
+                               target_rel(source[1], target[0]))     # constraint  (in)
+    return in_target_dir(cmd_line, target[0], for_signature)
     
                
 #
@@ -441,11 +783,83 @@ def generate_bitgen (source, target, env, for_signature):
     -g Encrypt:No \
     {1}"""
     cmd_line=cmd_line.format(env.subst('$INTSTYLE'),
-                             os.path.basename(str(source[0])))
-    return cmd_line
+                             target_rel(source[0], target[0]))
+    return in_target_dir(cmd_line, target[0], for_signature)
 
 
-def do_xilinx(env,project=None,plat=None):
+#
+# Step 6 (optional): Patch block RAM contents into a bitstream
+#
+def generate_data2mem (source, target, env, for_signature):
+
+    """Command line for data2mem.  Expect the following sources
+    [0]=.bit file, [1]=.bmm file, [2:]=memory images; $DATA2MEM_TAGS
+    gives the BMM tag of each image, or None for all of them."""
+
+    tags = env.get('DATA2MEM_TAGS') or []
+    args = ['$DATA2MEM',
+            '-bm', str(source[1]),
+            '-bt', str(source[0])]
+    for (i, image) in enumerate(source[2:]):
+        args.extend(['-bd', str(image)])
+        if i < len(tags) and tags[i] is not None:
+            args.extend(['tag', tags[i]])
+    args.extend(['-o', 'b', str(target[0])])
+    return ' '.join(args)
+
+def patch_bitstreams(env, bit, bmm, images, out_dir=None):
+
+    """Make one bitstream per entry of images, {name: memory images},
+    by patching the block RAMs of an implemented bitstream bit (as
+    described by bmm) with data2mem; no re-implementation needed.  The
+    memory images are a file, or a list whose items are files or
+    (file, BMM tag) pairs.  Each result is out_dir/name.bit (out_dir
+    defaults to bit's directory).  Returns the new .bit nodes."""
+
+    if out_dir is None:
+        out_dir = os.path.dirname(str(bit))
+    patched = []
+    for name in sorted(images.keys()):
+        name_images = images[name]
+        if SCons.Util.is_String(name_images) or isinstance(name_images, tuple):
+            name_images = [name_images]
+        files = []
+        tags = []
+        for image in name_images:
+            if isinstance(image, tuple):
+                (image, tag) = image
+            else:
+                tag = None
+            files.append(image)
+            tags.append(tag)
+        patched.extend(env.Data2Mem(os.path.join(out_dir, name + '.bit'),
+                                    [bit, bmm] + files,
+                                    DATA2MEM_TAGS=tags))
+    return patched
+
+def add_data2mem(env):
+    """Add the Data2Mem builder and env.PatchBitstreams()"""
+    env.SetDefault(DATA2MEM='data2mem')
+    data2mem = Builder(generator=generate_data2mem, suffix='.bit')
+    env.Append(BUILDERS={'Data2Mem' : data2mem})
+    env.AddMethod(patch_bitstreams, 'PatchBitstreams')
+
+
+# Variant overrides naming files, given relative to the top directory
+VARIANT_FILE_VARIABLES = ['UCF', 'CHIPSCOPE_FILE']
+
+def do_xilinx(env,project=None,plat=None,variants=None):
+    # variants, if given, asks for one image per device: a list of
+    # dicts, each with a unique 'name' (its build directory under
+    # $WORK_DIR; one variant may leave it out and build in $WORK_DIR)
+    # and construction variables to override, usually 'UCF' and maybe
+    # 'CHIPSCOPE_FILE'.  A 'GENERICS' entry replaces the project's XST
+    # generics; variants with the same generics share one synthesis.
+    # E.g. [{'name': 'left', 'UCF': 'left.ucf'},
+    #       {'name': 'right', 'UCF': 'right.ucf', 'GENERICS': 'SIDE=1'}]
+    #
+    # Returns the .bit file nodes.
+
     # Allow for different behavior on Windows, Linux, etc.
     # No such difference implemented yet, though.
     if project is None:
@@ -477,7 +891,10 @@ def do_xilinx(env,project=None,plat=None):
 
     ##Project-specifc  preferences.  These should be discovered in some smarter way
     env['INTSTYLE'] = 'silent'
-    
+
+    # Reuse what earlier runs learned about the .xise hierarchy
+    env.SetDefault(XISE_INDEX_FILE=File('.scons_build_tmp/xise_index'))
+    use_xise_index(env.File(env['XISE_INDEX_FILE']).abspath)
     
     conf = Configure(env)
     process_project_file(conf, project)
@@ -490,65 +907,122 @@ def do_xilinx(env,project=None,plat=None):
     FILE_STEM=env.subst('$FILE_STEM')
     VariantDir(WORK_DIR, '.', duplicate=0)
 
+    # Where ngdbuild finds the cores, wherever it runs
+    env.SetDefault(COREGEN_DIR=env.Dir(WORK_DIR).Dir('../../coregen').abspath)
 
-    #  Step 0
-    preconfig=Builder(action=build_xst_and_prj)
-    env.Append(BUILDERS={'Preconfig' : preconfig})
-    env.Preconfig([os.path.join(WORK_DIR, FILE_STEM + '.xst'),
-                   os.path.join(WORK_DIR, FILE_STEM + '.prj')],
-                  env.subst('$PROJECTFILE'))
-
-    # Step 1
+    # Builders
+    preconfig=Builder(action=Action(build_xst_and_prj, varlist=['XST_GENERICS']))
     xst = Builder(generator=generate_xst, emitter=source_files_from_xise,
-                  chdir=True, suffix=".ngc", src_suffix=".xst")
-    env.Append(BUILDERS={'Xst' : xst})
-    
-    xst_build = env.Xst(os.path.join(WORK_DIR, FILE_STEM +'.ngc'),
-                        os.path.abspath(env.subst('$PROJECTFILE')))
-
-    # Step 2.1
-    insert = Builder(generator=generate_chipsope_insert, chdir=True,
+                  suffix=".ngc", src_suffix=".xst")
+    insert = Builder(generator=generate_chipsope_insert,
                      suffix="_cs.ngc", src_suffix=".ngc")
+    ngd = Builder(generator=generate_ngdbuild)
+    map = Builder(generator=generate_map)
+    par = Builder(generator=generate_par)
+    bitgen = Builder(generator=generate_bitgen)
+    env.Append(BUILDERS={'Preconfig' : preconfig,
+                         'Xst' : xst,
+                         'Insert' : insert,
+                         'Ngd' : ngd,
+                         'Map' : map,
+                         'Par' : par,
+                         'Bitgen' : bitgen})
+    add_data2mem(env)
+
+    # One image, from the project's own constraints, unless we're asked
+    # for several
+    if variants is None:
+        variants = [{}]
+
+    # Each variant builds in a directory of its own
+    names = [variant.get('name') for variant in variants]
+    for name in seq_dedup(names):
+        if names.count(name) > 1:
+            if name is None:
+                print "Only one variant may leave out its 'name'"
+            else:
+                print "More than one variant is named '%s'" % (name)
+            Exit(1)
+
+    # Variants with the same generics share one synthesis
+    netlists = {}
+    bitfiles = []
+    for variant in variants:
+        variant = dict(variant)
+        name = variant.pop('name', None)
+        generics = variant.pop('GENERICS', None)
+        if generics not in netlists:
+            if generics is None:
+                xst_dir = WORK_DIR
+            else:
+                xst_dir = os.path.join(WORK_DIR, 'xst_' + hashlib.md5(generics).hexdigest()[:8])
+            netlists[generics] = synthesize(env.Clone(WORK_DIR=xst_dir, XST_GENERICS=generics),
+                                            xst_dir, FILE_STEM)
+        if name is None:
+            impl_dir = WORK_DIR
+        else:
+            impl_dir = os.path.join(WORK_DIR, name)
+        # Tools name these from their own directories
+        for var in VARIANT_FILE_VARIABLES:
+            if variant.get(var) is not None:
+                variant[var] = os.path.abspath(variant[var])
+        bitfiles.extend(implement(env.Clone(WORK_DIR=impl_dir, **variant),
+                                  netlists[generics], impl_dir, FILE_STEM))
+    return bitfiles
+
+
+def synthesize(env, xst_dir, file_stem):
 
+    """Steps 0 and 1: .xst and .prj files for $PROJECTFILE, then XST,
+    in xst_dir.  Returns the .ngc node."""
+
+    preconfig = env.Preconfig([os.path.join(xst_dir, file_stem + '.xst'),
+                               os.path.join(xst_dir, file_stem + '.prj')],
+                              env.subst('$PROJECTFILE'))
+    # The .xst file holds the XST options
+    if 'XISE_PY_PROPFILE' in env:
+        Depends(preconfig, prop_section(env, 'Synthesize - XST'))
+    return env.Xst(os.path.join(xst_dir, file_stem + '.ngc'),
+                   os.path.abspath(env.subst('$PROJECTFILE')))[0]
+
+
+def implement(env, netlist, impl_dir, file_stem):
+
+    """Steps 2 to 5: ChipScope insertion (if $CHIPSCOPE_FILE is set),
+    ngdbuild with $UCF, map, PAR and bitgen of netlist, in impl_dir.
+    Returns the .bit file node(s)."""
+
+    # Step 2.1
     # If CHIPSCOPE_FILE isn't defined, then the "real" .ngc file does not
     # depend on the _cs.ngc file.
     if env['CHIPSCOPE_FILE'] is not None:
-        env.Append(BUILDERS={'Insert': insert})
-        do_insert=env.Insert(os.path.join(WORK_DIR, FILE_STEM + '_cs.ngc'),
-                             os.path.join(WORK_DIR, FILE_STEM + '.ngc'))
-        Depends(do_insert,[env.subst('$CHIPSCOPE_FILE'), env.subst('$UCF')])
+        netlist = env.Insert(os.path.join(impl_dir, file_stem + '_cs.ngc'),
+                             netlist)
+        Depends(netlist,[env.subst('$CHIPSCOPE_FILE'), env.subst('$UCF')])
 
     # Step 2.2
-    ngd = Builder(generator=generate_ngdbuild,
-                  chdir=True)
-    env.Append(BUILDERS={'Ngd' : ngd})
-    
-    ngd_build=env.Ngd(os.path.join(WORK_DIR, FILE_STEM +'.ngd'),
-                      os.path.join(WORK_DIR, FILE_STEM + '_cs.ngc'))
+    ngd_build=env.Ngd(os.path.join(impl_dir, file_stem +'.ngd'), netlist)
+    # ngdbuild reads the UCF itself, chipscope or not
+    Depends(ngd_build, env.subst('$UCF'))
     if env['CHIPSCOPE_FILE'] is not None:
-        Depends(ngd_build,[env.subst('$CHIPSCOPE_FILE'), env.subst('$UCF')])
+        Depends(ngd_build, env.subst('$CHIPSCOPE_FILE'))
 
     # Step 3
-    map = Builder(generator=generate_map,
-                  chdir=True)
-    env.Append(BUILDERS={'Map' : map})
-    do_map=env.Map([os.path.join(WORK_DIR, FILE_STEM + '_map.ncd'),
-                    os.path.join(WORK_DIR, FILE_STEM +'.pcf')],
-                   os.path.join(WORK_DIR, FILE_STEM + '.ngd'))
+    do_map=env.Map([os.path.join(impl_dir, file_stem + '_map.ncd'),
+                    os.path.join(impl_dir, file_stem +'.pcf')],
+                   os.path.join(impl_dir, file_stem + '.ngd'))
+
+    # ngdbuild and map options come from their sections of the
+    # properties file
+    if 'XISE_PY_PROPFILE' in env:
+        Depends(ngd_build, prop_section(env, 'Translate'))
+        Depends(do_map, prop_section(env, 'Map'))
     
     # Step 4
-    par = Builder(generator=generate_par,
-              chdir=True)
-    env.Append(BUILDERS={'Par' : par})
-    do_par=env.Par(os.path.join(WORK_DIR, FILE_STEM + '.ncd'),
-                   [os.path.join(WORK_DIR, FILE_STEM + '_map.ncd'),
-                    os.path.join(WORK_DIR, FILE_STEM + '.pcf')])
+    do_par=env.Par(os.path.join(impl_dir, file_stem + '.ncd'),
+                   [os.path.join(impl_dir, file_stem + '_map.ncd'),
+                    os.path.join(impl_dir, file_stem + '.pcf')])
 
     # Step 5
-    bitgen = Builder(generator=generate_bitgen, chdir=True)
-    env.Append(BUILDERS={'Bitgen' : bitgen})
-    do_bitgen=env.Bitgen(os.path.join(WORK_DIR, FILE_STEM + '.bit'),
-                         os.path.join(WORK_DIR, FILE_STEM + '.ncd'))
-
-    
-    return None
+    return env.Bitgen(os.path.join(impl_dir, file_stem + '.bit'),
+                      os.path.join(impl_dir, file_stem + '.ncd'))
@@ -1,9 +1,27 @@
 #!/usr/bin/env python
 import sys
-from parcon import *
+import os
+import re
+import glob
+import hashlib
+import cPickle
+import UserDict
+import time
+import json
+import threading
+import multiprocessing
+import optparse
 import pprint
 
+import xil_ise
+
 def mkparser():
+
+    """The original parcon grammar for property dumps.  No longer used
+    by process(); kept so the benchmark can compare against it.
+    parcon is only needed if this is called."""
+
+    from parcon import Forward, Exact, OneOrMore, ZeroOrMore, CharNotIn, SignificantLiteral, concat
     group = Forward()
     basic_string = Exact(OneOrMore(CharNotIn(['{','}',':'])))[concat]
     quoted_string="{" + basic_string + "}"
@@ -12,32 +30,421 @@ def mkparser():
     group << foo(name="group")
     groups = OneOrMore(group)
     return groups
-    
 
-def process(input,verbose=False):
 
-    def interpret(value):
-        if type(value) == str:
-            if value in ['true','TRUE','True']:
-                return True
-            if value in ['false','FALSE','False']:
+def interpret(value):
+    if type(value) == str:
+        if value in ['true','TRUE','True']:
+            return True
+        if value in ['false','FALSE','False']:
+            return False
+        try:
+            i_value = int(value)
+            return i_value
+        except ValueError:
+            pass
+        try:
+            f_value = float(value)
+            return f_value
+        except ValueError:
+            pass
+        return value.decode('string_escape')
+    if ((type(value) == list) and
+        (value==[])):
+        return None
+    raise ValueError("Cannot process non-string value " + repr(value))
+
+
+##
+## Tcl list tokenizer.  A property dump is the Tcl string form of
+##
+##   {{process} {{{property} : value} ...}} ...
+##
+## tcl_words() splits one level of such a list into the spans of its
+## words, skipping over nested braces without interpreting them, so
+## each nesting level costs one pass over its own text.
+##
+
+_SPACE_RE = re.compile(r'\s*')
+_BRACE_RE = re.compile(r'[{}\\]')
+_BARE_RE = re.compile(r'(?:[^\s\\]|\\.)+', re.S)
+
+def tcl_words(s, start=0, end=None):
+
+    """Return [(start, end), ...] spans of the words in the Tcl list
+    s[start:end].  A braced word's span excludes the braces."""
+
+    if end is None:
+        end = len(s)
+    words = []
+    i = _SPACE_RE.match(s, start, end).end()
+    while i < end:
+        if s[i] == '{':
+            depth = 1
+            j = i + 1
+            while depth:
+                m = _BRACE_RE.search(s, j, end)
+                if m is None:
+                    raise ValueError("Unbalanced braces in Tcl list at offset %d" % (i))
+                j = m.end()
+                c = m.group()
+                if c == '{':
+                    depth += 1
+                elif c == '}':
+                    depth -= 1
+                else:
+                    j += 1              # backslash: skip the escaped character
+            words.append((i + 1, j - 1))
+        else:
+            m = _BARE_RE.match(s, i, end)
+            j = m.end()
+            words.append((i, j))
+        i = _SPACE_RE.match(s, j, end).end()
+    return words
+
+def _process_spans(input):
+    """[(process name, (start, end) of its property list), ...]"""
+    spans = []
+    for (g_start, g_end) in tcl_words(input):
+        words = tcl_words(input, g_start, g_end)
+        if len(words) != 2:
+            raise ValueError("Expected {process {properties}}, found %s" % (repr(input[g_start:g_end][:80])))
+        (n_start, n_end) = words[0]
+        spans.append((input[n_start:n_end].strip(), words[1]))
+    return spans
+
+##
+## Compact property tables.  Property names, and the order they come
+## in, are the same for a process across every project, and most
+## values repeat too; so names are interned, each distinct tuple of
+## names (a schema) is stored once, and values are shared.
+##
+
+_schemas = {}
+_values = {}
+
+def _schema(names):
+    """The shared (names, {name : index}) for a tuple of names"""
+    try:
+        return _schemas[names]
+    except KeyError:
+        pass
+    names = tuple([intern(n) for n in names])
+    index = dict([(n, i) for (i, n) in enumerate(names)])
+    return _schemas.setdefault(names, (names, index))
+
+def _shared_value(value):
+    if type(value) == str:
+        return intern(value)
+    # Keyed by type too, so that True, 1 and 1.0 stay distinct
+    return _values.setdefault((type(value), value), value)
+
+class PropertyTable(UserDict.DictMixin, object):
+
+    """{property : value} for one process, stored as a shared schema
+    plus a list of shared values.  Supports the usual dict operations
+    (including copy()), and is cheap to copy when SCons clones an
+    environment."""
+
+    __slots__ = ('_schema', '_values')
+
+    def __init__(self, items=()):
+        if hasattr(items, 'keys'):
+            items = [(k, items[k]) for k in items.keys()]
+        names = []
+        values = []
+        seen = {}
+        for (name, value) in items:
+            i = seen.get(name)
+            if i is None:
+                seen[name] = len(names)
+                names.append(name)
+                values.append(_shared_value(value))
+            else:
+                values[i] = _shared_value(value)
+        self._schema = _schema(tuple(names))
+        self._values = values
+
+    def __getitem__(self, name):
+        return self._values[self._schema[1][name]]
+
+    def __setitem__(self, name, value):
+        value = _shared_value(value)
+        (names, index) = self._schema
+        i = index.get(name)
+        if i is None:
+            self._schema = _schema(names + (name,))
+            self._values.append(value)
+        else:
+            self._values[i] = value
+
+    def __delitem__(self, name):
+        (names, index) = self._schema
+        i = index[name]
+        self._schema = _schema(names[:i] + names[i+1:])
+        del self._values[i]
+
+    def __contains__(self, name):
+        return name in self._schema[1]
+
+    def __iter__(self):
+        return iter(self._schema[0])
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self):
+        return list(self._schema[0])
+
+    def __eq__(self, other):
+        if not hasattr(other, 'keys'):
+            return NotImplemented
+        return dict(self.iteritems()) == dict(other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def copy(self):
+        table = PropertyTable.__new__(PropertyTable)
+        table._schema = self._schema
+        table._values = list(self._values)
+        return table
+
+    # Used by SCons when cloning an environment
+    __semi_deepcopy__ = copy
+
+    def __reduce__(self):
+        return (PropertyTable, (zip(self._schema[0], self._values),))
+
+def _raw_properties(input, start, end):
+    """[(property, uninterpreted value), ...] for one property list"""
+    items = []
+    for (p_start, p_end) in tcl_words(input, start, end):
+        words = tcl_words(input, p_start, p_end)
+        if len(words) != 3 or input[words[1][0]:words[1][1]] != ':':
+            raise ValueError("Expected {property : value}, found %s" % (repr(input[p_start:p_end][:80])))
+        items.append((input[words[0][0]:words[0][1]].strip(),
+                      input[words[2][0]:words[2][1]]))
+    return items
+
+def _properties(input, start, end, verbose=False):
+    items = []
+    for (n, v) in _raw_properties(input, start, end):
+        if verbose:
+            print "   property:%s=%s" % (n,v)
+        if v == '':
+            # Only an empty braced word can be empty
+            v = []
+        items.append((n, interpret(v)))
+    return PropertyTable(items)
+
+class LazyProcesses(UserDict.DictMixin):
+
+    """{process : {property : value}} for a property dump, where a
+    process's properties are only tokenized and interpreted the first
+    time that process is looked up.  Building one only finds where
+    each process's section starts and ends."""
+
+    def __init__(self, input):
+        self._input = input
+        self._spans = {}
+        self._order = []
+        for (process, span) in _process_spans(input):
+            if process not in self._spans:
+                self._order.append(process)
+            self._spans[process] = span
+        self._parsed = {}
+
+    def __getitem__(self, process):
+        try:
+            return self._parsed[process]
+        except KeyError:
+            pass
+        (start, end) = self._spans[process]
+        property_dict = self._parsed[process] = self._parse(start, end)
+        return property_dict
+
+    def _parse(self, start, end):
+        return _properties(self._input, start, end)
+
+    def __setitem__(self, process, property_dict):
+        if process not in self._spans:
+            self._order.append(process)
+            self._spans[process] = None
+        self._parsed[process] = property_dict
+
+    def __delitem__(self, process):
+        del self._spans[process]
+        self._order.remove(process)
+        self._parsed.pop(process, None)
+
+    def __contains__(self, process):
+        return process in self._spans
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def keys(self):
+        return list(self._order)
+
+    def section_text(self, process):
+        """The unparsed text of a process's property list, as it
+        appears in the dump"""
+        span = self._spans[process]
+        if span is None:
+            raise KeyError(process)
+        return self._input[span[0]:span[1]]
+
+def process(input,verbose=False,lazy=False):
+
+    """Parse a property dump (as written by xprop_extract.tcl) into
+    {process : {property : value}}.  If lazy is true, return a
+    LazyProcesses, which parses each process on first use."""
+
+    if lazy:
+        return LazyProcesses(input)
+    process_dict={}
+    for (process, (start, end)) in _process_spans(input):
+        if verbose:
+            print "process: " + process
+        process_dict[process]=_properties(input, start, end, verbose)
+    return process_dict
+
+def process_raw(input):
+
+    """Like process(), but returns [(process, [(property, value), ...]),
+    ...] in dump order, with each value exactly as written in the dump
+    ('' for an empty value).  format_dump() turns this back into a
+    dump."""
+
+    return [(process, _raw_properties(input, start, end))
+            for (process, (start, end)) in _process_spans(input)]
+
+
+##
+## Writing dumps
+##
+
+_TCL_SPECIAL_RE = re.compile(r'[\s{}\[\]$";\\]')
+
+def _braces_balanced(word):
+    depth = 0
+    for c in word:
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth < 0:
                 return False
-            try:
-                i_value = int(value)
-                return i_value
-            except ValueError:
-                pass
-            try:
-                f_value = float(value)
-                return f_value
-            except ValueError:
-                pass
-            return value.decode('string_escape')
-        if ((type(value) == list) and
-            (value==[])):
-            return None
-        raise ValueError("Cannot process non-string value " + repr(value))
-    
+    return depth == 0
+
+def tcl_quote(word):
+    """Quote word as an element of a Tcl list, as Tcl itself would"""
+    if word == '':
+        return '{}'
+    if _TCL_SPECIAL_RE.search(word) is None:
+        return word
+    if _braces_balanced(word) and not word.endswith('\\'):
+        return '{' + word + '}'
+    return re.sub(r'([\s{}\[\]$";\\])', r'\\\1', word)
+
+def tcl_list(words):
+    return ' '.join([tcl_quote(w) for w in words])
+
+def format_dump(raw):
+
+    """Format [(process, [(property, value), ...]), ...] (see
+    process_raw) the way xprop_extract.tcl writes it"""
+
+    return tcl_list([tcl_list([process,
+                               tcl_list([tcl_list([n, ':', v]) for (n, v) in properties])])
+                     for (process, properties) in raw])
+
+
+##
+## Content-addressed cache of parsed process sections, shared by later
+## runs and by concurrent SCons processes on the same tree
+##
+
+# Number of parsed sections kept; the least recently used go first
+PROPS_CACHE_SIZE = 64
+
+# Part of every entry's name; changes whenever the parse results or
+# PropertyTable do, so old entries are never served
+PROPS_CACHE_VERSION = 2
+
+def _evict(cache_dir, max_entries):
+    entries = []
+    for path in glob.glob(os.path.join(cache_dir, '*.pickle')):
+        try:
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            pass                        # evicted by someone else
+    entries.sort()
+    for (mtime, path) in entries[:max(len(entries) - max_entries, 0)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _load_cached(path):
+    try:
+        property_dict = xil_ise.read_pickle(path)
+        os.utime(path, None)            # recently used
+    except Exception:
+        # Missing, truncated, corrupt or from some other version: a miss
+        return None
+    if not isinstance(property_dict, PropertyTable):
+        return None
+    return property_dict
+
+def _store_cached(path, property_dict, cache_dir, max_entries):
+    try:
+        xil_ise.write_pickle(path, property_dict)
+    except (IOError, OSError, cPickle.PicklingError):
+        # Only ever an optimisation: a cache we can't write is no cache
+        return
+    _evict(cache_dir, max_entries)
+
+class CachedProcesses(LazyProcesses):
+
+    """A LazyProcesses that keeps each process's parsed properties in
+    cache_dir under the MD5 of that process's section of the dump.  A
+    section is still only parsed (or loaded) when it is looked up, so
+    processes the build never reads cost nothing, hit or miss."""
+
+    def __init__(self, input, cache_dir, max_entries=PROPS_CACHE_SIZE):
+        LazyProcesses.__init__(self, input)
+        self._cache_dir = cache_dir
+        self._max_entries = max_entries
+
+    def _parse(self, start, end):
+        key = hashlib.md5(self._input[start:end]).hexdigest()
+        path = os.path.join(self._cache_dir,
+                            '%s.v%d.pickle' % (key, PROPS_CACHE_VERSION))
+        property_dict = _load_cached(path)
+        if property_dict is None:
+            property_dict = LazyProcesses._parse(self, start, end)
+            _store_cached(path, property_dict, self._cache_dir, self._max_entries)
+        return property_dict
+
+def process_cached(input, cache_dir, max_entries=PROPS_CACHE_SIZE):
+
+    """process(input, lazy=True), with each process parsed at most
+    once across runs: see CachedProcesses.  At most max_entries
+    parsed processes are kept in cache_dir."""
+
+    return CachedProcesses(input, cache_dir, max_entries)
+
+def process_parcon(input,verbose=False):
+
+    """process(), using the original parcon grammar"""
+
     listy=mkparser().parse_string(input)
     process_dict={}
     for (process, properties) in listy:
@@ -52,12 +459,139 @@ def process(input,verbose=False):
         process_dict[process.strip()]=property_dict
     return process_dict
 
+
+##
+## Benchmark against the parcon parser
+##
+
+def synthetic_dump(processes=40, properties=80):
+
+    """Make a property dump about the size of a real one containing
+    every process, with a mix of bare, braced and empty values."""
+
+    groups = []
+    for p in range(processes):
+        props = []
+        for i in range(properties):
+            kind = i % 5
+            if kind == 0:
+                value = 'true'
+            elif kind == 1:
+                value = str(i)
+            elif kind == 2:
+                value = '{}'
+            elif kind == 3:
+                value = '{%s}' % (' '.join(['/some/long/path/to/dir%d' % k for k in range(8)]))
+            else:
+                value = 'Value_%d' % (i)
+            props.append('{{Property %d of process %d} : %s}' % (i, p, value))
+        groups.append('{{Process %d - Step} {%s}}' % (p, ' '.join(props)))
+    return ' '.join(groups)
+
+def benchmark(dumps, repeat=3, out=sys.stdout):
+
+    """Time process() and process_parcon() on each dump, checking
+    that they agree."""
+
+    for (name, dump) in dumps:
+        times = {}
+        results = {}
+        for fn in [process, process_parcon]:
+            best = None
+            for r in range(repeat):
+                start = time.time()
+                results[fn] = fn(dump)
+                elapsed = time.time() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            times[fn] = best
+        agree = results[process] == results[process_parcon]
+        out.write("%s: %d bytes, tokenizer %.4fs, parcon %.4fs (%.1fx)%s\n" %
+                  (name, len(dump), times[process], times[process_parcon],
+                   times[process_parcon] / max(times[process], 1e-9),
+                   '' if agree else ', RESULTS DIFFER'))
+
+##
+## Bulk mode: parse many dumps on a process pool, writing JSON lines
+##
+
+def _parse_file_json(filename):
+    try:
+        f = open(filename)
+        try:
+            process_dict = process(f.read().strip())
+        finally:
+            f.close()
+        return json.dumps({'file' : filename,
+                           'properties' : dict([(p, dict(props.iteritems()))
+                                                for (p, props) in process_dict.iteritems()])},
+                          sort_keys=True)
+    except Exception, e:
+        # Always answer, or bulk() would wait for this file forever
+        return json.dumps({'file' : filename.decode('utf-8', 'replace'),
+                           'error' : str(e).decode('utf-8', 'replace')},
+                          sort_keys=True)
+
+def bulk(filenames, jobs=None, out=sys.stdout):
+
+    """Parse every dump file named in the iterable filenames on a pool
+    of 'jobs' processes, writing one JSON object per line to out as
+    each finishes (so not in input order).  Only a few files per
+    worker are in flight at once, however many are given."""
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    in_flight = threading.BoundedSemaphore(jobs * 4)
+    def done(line):
+        out.write(line + '\n')
+        out.flush()
+        in_flight.release()
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for filename in filenames:
+            in_flight.acquire()
+            pool.apply_async(_parse_file_json, (filename,), callback=done)
+    finally:
+        pool.close()
+        pool.join()
+
 def main(argv):
+    usage = "usage: %prog [options] [dump files]"
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option("-b", "--benchmark", action="store_true", dest="benchmark",
+                      help="compare the tokenizer with the parcon parser")
+    parser.add_option("-n", "--repeat", type="int", dest="repeat",
+                      help="benchmark repetitions (best is reported)")
+    parser.add_option("--bulk", action="store_true", dest="bulk",
+                      help="parse the dump files given (or named one per line on stdin) in parallel, writing JSON lines")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs",
+                      help="worker processes for --bulk (default: one per CPU)")
+    parser.set_defaults(benchmark=False)
+    parser.set_defaults(repeat=3)
+    parser.set_defaults(bulk=False)
+    parser.set_defaults(jobs=None)
+    (opts, args) = parser.parse_args(argv[1:])
+
+    if opts.benchmark:
+        dumps = [(f, open(f).read().strip()) for f in args]
+        if dumps == []:
+            dumps = [('synthetic', synthetic_dump())]
+        benchmark(dumps, opts.repeat)
+        return 0
+
+    if opts.bulk:
+        if args:
+            filenames = args
+        else:
+            filenames = (line.strip() for line in sys.stdin if line.strip())
+        bulk(filenames, opts.jobs)
+        return 0
+
     for line in sys.stdin:
         x=process(line.strip())
         pprint.pprint(x)
 
-        
+
 
 if __name__ == '__main__':
     sys.exit(main(sys.argv))
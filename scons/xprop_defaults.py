@@ -0,0 +1,198 @@
+##
+## Process property defaults, for reading properties straight out of
+## a .xise file without starting xtclsh.
+##
+## A .xise file only records the properties the user has touched (and
+## some that ISE felt like writing down); everything else takes the
+## default of the ISE version that wrote the file.  The tables below
+## give, per ISE version and per process, the properties that the
+## option tables in xil_ise know how to turn into command line
+## flags: the name as xprop_extract.tcl reports it, the names it may
+## be stored under in the .xise file (ISE tacks the process or device
+## family onto names shared between processes), and the value ISE
+## uses when the file does not mention it.
+##
+## A default of UNKNOWN means the value depends on the project in a
+## way we can't work out here (the device, the project directory...).
+## Unless the .xise file gives it, that property (only) is left to
+## xprop_extract.tcl.
+##
+## The values are those of ISE 13.x; they are raw Tcl words, exactly
+## as they'd appear in a property dump.  Each table names every
+## property of the matching xil_ise option table (XST's -tmpdir,
+## keyed None there, is not a property).
+##
+
+import xil_ise
+
+UNKNOWN = object()
+
+_XST = [('Optimization Goal', ['Optimization Goal'], 'Speed'),
+        ('Optimization Effort', ['Optimization Effort'], 'Normal'),
+        ('Power Reduction', ['Power Reduction Xst', 'Power Reduction'], 'false'),
+        ('Use Synthesis Constraints File', ['Use Synthesis Constraints File'], 'true'),
+        ('Synthesis Constraints File', ['Synthesis Constraints File'], ''),
+        ('Keep Hierarchy', ['Keep Hierarchy'], 'No'),
+        ('Netlist Hierarchy', ['Netlist Hierarchy'], 'As Optimized'),
+        ('Global Optimization Goal', ['Global Optimization Goal'], 'AllClockNets'),
+        ('Generate RTL Schematic', ['Generate RTL Schematic'], 'Yes'),
+        ('Read Cores', ['Read Cores'], 'true'),
+        ('Cores Search Directories', ['Cores Search Directories'], ''),
+        ('Write Timing Constraints', ['Write Timing Constraints'], 'false'),
+        ('Cross Clock Analysis', ['Cross Clock Analysis'], 'false'),
+        ('Hierarchy Separator', ['Hierarchy Separator'], '/'),
+        ('Bus Delimiter', ['Bus Delimiter'], '<>'),
+        ('LUT-FF Pairs Utilization Ratio', ['LUT-FF Pairs Utilization Ratio'], '100'),
+        ('BRAM Utilization Ratio', ['BRAM Utilization Ratio'], '100'),
+        ('DSP Utilization Ratio', ['DSP Utilization Ratio'], '100'),
+        ('Case', ['Case'], 'Maintain'),
+        ('Library Search Order', ['Library Search Order'], UNKNOWN),
+        ('Library for Verilog Sources', ['Library for Verilog Sources'], ''),
+        ('Verilog Include Directories', ['Verilog Include Directories'], ''),
+        ('Generics, Parameters', ['Generics, Parameters'], ''),
+        ('Verilog Macros', ['Verilog Macros'], ''),
+        ('FSM Extraction', ['FSM Extraction'], 'Yes'),
+        ('FSM Encoding Algorithm', ['FSM Encoding Algorithm'], 'Auto'),
+        ('Safe Implementation', ['Safe Implementation'], 'No'),
+        ('Case Implementation Style', ['Case Implementation Style'], 'None'),
+        ('FSM Style', ['FSM Style'], 'LUT'),
+        ('RAM Extraction', ['RAM Extraction'], 'true'),
+        ('RAM Style', ['RAM Style'], 'Auto'),
+        ('ROM Extraction', ['ROM Extraction'], 'true'),
+        ('ROM Style', ['ROM Style'], 'Auto'),
+        ('Automatic BRAM Packing', ['Automatic BRAM Packing'], 'false'),
+        ('Shift Register Extraction', ['Shift Register Extraction'], 'true'),
+        ('Shift Register Minimum Size', ['Shift Register Minimum Size'], '2'),
+        ('Resource Sharing', ['Resource Sharing'], 'true'),
+        ('Use DSP Block', ['Use DSP Block Spartan6', 'Use DSP Block Virtex6', 'Use DSP Block'], 'Auto'),
+        ('Asynchronous To Synchronous', ['Asynchronous To Synchronous'], 'false'),
+        ('Add I/O Buffers', ['Add I/O Buffers'], 'true'),
+        ('Max Fanout', ['Max Fanout'], '100000'),
+        ('Number of Clock Buffers', ['Number of Clock Buffers'], UNKNOWN),
+        ('Register Duplication', ['Register Duplication Xst', 'Register Duplication'], 'true'),
+        ('Equivalent Register Removal', ['Equivalent Register Removal XST', 'Equivalent Register Removal'], 'true'),
+        ('Register Balancing', ['Register Balancing'], 'No'),
+        ('Move First Flip-Flop Stage', ['Move First Flip-Flop Stage'], 'true'),
+        ('Move Last Flip-Flop Stage', ['Move Last Flip-Flop Stage'], 'true'),
+        ('Pack I/O Registers into IOBs', ['Pack I/O Registers into IOBs'], 'Auto'),
+        ('LUT Combining', ['LUT Combining Xst', 'LUT Combining'], 'Auto'),
+        ('Reduce Control Sets', ['Reduce Control Sets'], 'Auto'),
+        ('Use Clock Enable', ['Use Clock Enable'], 'Auto'),
+        ('Use Synchronous Set', ['Use Synchronous Set'], 'Auto'),
+        ('Use Synchronous Reset', ['Use Synchronous Reset'], 'Auto'),
+        ('Optimize Instantiated Primitives', ['Optimize Instantiated Primitives'], 'false'),
+        ('Other XST Command Line Options', ['Other XST Command Line Options'], ''),
+        ('Work Directory', ['Work Directory'], UNKNOWN),
+        ('HDL INI File', ['HDL INI File'], UNKNOWN)]
+
+_NGD = [('Allow Unexpanded Blocks', ['Allow Unexpanded Blocks'], 'false'),
+        ('Allow Unmatched LOC Constraints', ['Allow Unmatched LOC Constraints'], 'false'),
+        ('Allow Unmatched Timing Group Constraints', ['Allow Unmatched Timing Group Constraints'], 'false'),
+        ('Create I/O Pads from Ports', ['Create I/O Pads from Ports'], 'false'),
+        ('Macro Search Path', ['Macro Search Path'], ''),
+        ('Netlist Translation Type', ['Netlist Translation Type'], 'Timestamp'),
+        ('Other Ngdbuild Command Line Options', ['Other Ngdbuild Command Line Options'], ''),
+        ('Use LOC Constraints', ['Use LOC Constraints'], 'true'),
+        ('User Rules File for Netlister Launcher', ['User Rules File for Netlister Launcher'], '')]
+
+_MAP = [('Allow Logic Optimization Across Hierarchy', ['Allow Logic Optimization Across Hierarchy'], 'false'),
+        ('Combinatorial Logic Optimization', ['Combinatorial Logic Optimization'], 'false'),
+        ('Enable Multi-Threading', ['Enable Multi-Threading'], 'Off'),
+        ('Equivalent Register Removal', ['Equivalent Register Removal Map', 'Equivalent Register Removal'], 'true'),
+        ('Extra Cost Tables', ['Extra Cost Tables Map', 'Extra Cost Tables'], '0'),
+        ('Generate Detailed MAP Report', ['Generate Detailed MAP Report'], 'false'),
+        ('Global Optimization', ['Global Optimization map', 'Global Optimization'], 'Off'),
+        ('Ignore User Timing Constraints', ['Ignore User Timing Constraints Map', 'Ignore User Timing Constraints'], 'false'),
+        ('LUT Combining', ['LUT Combining Map', 'LUT Combining'], 'Off'),
+        ('Map Slice Logic into Unused Block RAMs', ['Map Slice Logic into Unused Block RAMs'], 'false'),
+        ('Maximum Compression', ['Maximum Compression'], 'false'),
+        ('Other Map Command Line Options', ['Other Map Command Line Options'], ''),
+        ('Pack I/O Registers/Latches into IOBs', ['Pack I/O Registers/Latches into IOBs'], 'Off'),
+        ('Placer Effort Level', ['Placer Effort Level Map', 'Placer Effort Level'], 'High'),
+        ('Placer Extra Effort', ['Placer Extra Effort Map', 'Placer Extra Effort'], 'None'),
+        ('Power Activity File', ['Power Activity File'], ''),
+        ('Power Reduction', ['Power Reduction Map', 'Power Reduction'], 'Off'),
+        ('Register Duplication', ['Register Duplication Map', 'Register Duplication'], 'Off'),
+        ('Register Ordering', ['Register Ordering'], '4'),
+        ('Starting Placer Cost Table (1-100)', ['Starting Placer Cost Table (1-100) Map', 'Starting Placer Cost Table (1-100)'], '1'),
+        ('Timing Mode', ['Timing Mode Map', 'Timing Mode'], 'Performance Evaluation'),
+        ('Trim Unconnected Signals', ['Trim Unconnected Signals'], 'true'),
+        ('Use RLOC Constraints', ['Use RLOC Constraints'], 'Yes')]
+
+PROCESS_DEFAULTS = {'13': [('Synthesize - XST', _XST),
+                           ('Translate', _NGD),
+                           ('Map', _MAP)]}
+
+# The processes the build actually reads properties for
+NATIVE_PROCESSES = [process for (process, properties) in PROCESS_DEFAULTS['13']]
+
+
+def _version_defaults(version):
+    """The defaults table for an ISE version string such as '13.2'"""
+    while version:
+        if version in PROCESS_DEFAULTS:
+            return dict(PROCESS_DEFAULTS[version])
+        version = version.rpartition('.')[0]
+    return None
+
+def native_properties(xise_file, processes=None):
+
+    """Work out the properties of the named processes (default
+    NATIVE_PROCESSES) from xise_file alone.  Returns (raw, unresolved),
+    where raw is [(process, [(property, value), ...]), ...] in the
+    form xparseprops.format_dump() takes, and unresolved lists the
+    processes that need xprop_extract.tcl after all: those raw leaves
+    out, and those with a property whose value in raw is UNKNOWN.
+    resolve_properties() fills those in."""
+
+    if processes is None:
+        processes = NATIVE_PROCESSES
+    defaults = _version_defaults(xil_ise.get_project_ise_version(xise_file))
+    if defaults is None:
+        return [], list(processes)
+
+    stored = xil_ise.get_project_props(xise_file)
+    raw = []
+    unresolved = []
+    for process in processes:
+        if process not in defaults:
+            unresolved.append(process)
+            continue
+        properties = []
+        for (name, candidates, default) in defaults[process]:
+            value = default
+            for candidate in candidates:
+                if stored.get(candidate) is not None:
+                    value = stored[candidate]
+                    break
+            properties.append((name, value))
+        raw.append((process, properties))
+        if UNKNOWN in [value for (name, value) in properties]:
+            unresolved.append(process)
+    return raw, unresolved
+
+def resolve_properties(raw, extracted):
+
+    """Complete raw, as returned by native_properties(), from
+    extracted, the same project's properties from xprop_extract.tcl
+    in the same form.  UNKNOWN values are taken from extracted (and
+    left out if it lacks them); processes raw lacks are taken whole."""
+
+    extracted = dict(extracted)
+    resolved = []
+    for (process, properties) in raw:
+        if UNKNOWN in [value for (name, value) in properties]:
+            known = dict(extracted.get(process, []))
+            complete = []
+            for (name, value) in properties:
+                if value is UNKNOWN:
+                    if name not in known:
+                        continue
+                    value = known[name]
+                complete.append((name, value))
+            properties = complete
+        resolved.append((process, properties))
+    native = set([process for (process, properties) in raw])
+    resolved.extend([(process, properties) for (process, properties) in extracted.items()
+                     if process not in native])
+    return resolved
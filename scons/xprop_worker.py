@@ -0,0 +1,132 @@
+##
+## A long-lived xprop_extract.tcl, run in its -server mode, so that
+## reading the properties of many projects only starts xtclsh (and
+## ISE) once per build.
+##
+## Requests go down the worker's stdin as one Tcl list per line,
+##
+##   projfile out_file ?process ...?
+##
+## and each is answered by a line "#xprop_reply# OK" or
+## "#xprop_reply# ERROR message".  Any other line the worker writes
+## (ISE has plenty to say on stdout) is passed on to stderr.  Any
+## program that speaks this protocol will do as a worker, so a build
+## (or a test) can stand one in for xtclsh.
+##
+
+import os
+import sys
+import atexit
+import threading
+import subprocess
+import xparseprops
+
+
+# Starts every reply, as opposed to the tools' own output
+REPLY_MARKER = '#xprop_reply#'
+
+class XpropWorkerError(RuntimeError):
+    pass
+
+
+class XpropWorker(object):
+
+    """One worker process, started on the first request.  Requests
+    from several threads are handled one at a time."""
+
+    def __init__(self, command):
+        self.command = list(command)
+        self.lock = threading.Lock()
+        self.proc = None
+
+    def _start(self):
+        # stderr is left alone: that's where the worker's chatter goes
+        try:
+            self.proc = subprocess.Popen(self.command,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         close_fds=True)
+        except OSError, e:
+            raise XpropWorkerError("Unable to start property worker %s: %s"
+                                   % (' '.join(self.command), e.strerror or str(e)))
+
+    def extract(self, projfile, out_file, processes=()):
+
+        """Have the worker dump the properties of processes (all of
+        them, if empty) of projfile into out_file"""
+
+        request = xparseprops.tcl_list([os.path.abspath(projfile),
+                                        os.path.abspath(out_file)] + list(processes))
+        self.lock.acquire()
+        try:
+            if self.proc is None or self.proc.poll() is not None:
+                self._start()
+            try:
+                self.proc.stdin.write(request + '\n')
+                self.proc.stdin.flush()
+                reply = self._read_reply()
+            except IOError, e:
+                reply = ''
+            if reply == '':
+                # Start a fresh one for the next request
+                self._stop()
+                raise XpropWorkerError("Property worker %s exited while reading %s"
+                                       % (' '.join(self.command), projfile))
+        finally:
+            self.lock.release()
+        reply = reply[len(REPLY_MARKER):].strip()
+        if reply != 'OK':
+            raise XpropWorkerError("Property worker failed on %s: %s"
+                                   % (projfile, reply.partition(' ')[2] or reply))
+
+    def _read_reply(self):
+        """The next reply line, or '' if the worker went away"""
+        while True:
+            line = self.proc.stdout.readline()
+            if line == '' or line.startswith(REPLY_MARKER):
+                return line
+            sys.stderr.write(line)
+
+    def _stop(self):
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except IOError:
+            pass
+        proc.wait()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            self._stop()
+        finally:
+            self.lock.release()
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+def get_worker(command):
+    """The shared worker running command (a list of arguments)"""
+    key = tuple(command)
+    _workers_lock.acquire()
+    try:
+        if key not in _workers:
+            _workers[key] = XpropWorker(command)
+        return _workers[key]
+    finally:
+        _workers_lock.release()
+
+def close_workers():
+    _workers_lock.acquire()
+    try:
+        workers = _workers.values()
+        _workers.clear()
+    finally:
+        _workers_lock.release()
+    for w in workers:
+        w.close()
+
+atexit.register(close_workers)
@@ -0,0 +1,93 @@
+##
+## Running SCons on a scratch tree, with the stand-in tools in
+## tests/bin in place of ISE.  Run the tests from the top directory
+## with the Python SCons is installed for:
+##
+##   python -m unittest discover -s tests
+##
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BIN = os.path.join(REPO, 'tests', 'bin')
+DATA = os.path.join(REPO, 'tests', 'data')
+
+sys.path.insert(0, os.path.join(REPO, 'scons'))
+
+# Top of every SConstruct: an environment with the ise tool, whose
+# tools are the stand-ins
+SCONSTRUCT_HEAD = '''
+import os, sys
+sys.path.insert(0, %(scons_dir)r)
+env = Environment(ENV={'PATH' : %(bin)r + os.pathsep + os.environ['PATH']},
+                  tools=['ise'], toolpath=[%(site_tools)r],
+                  XBUILDSCRIPTS=%(repo)r,
+                  XTCLSH='%(python)s %(bin)s/xtclsh')
+'''
+
+def scons_command():
+    """How to run SCons with this Python"""
+    script = os.path.join(os.path.dirname(sys.executable), 'scons')
+    if os.path.exists(script):
+        return [sys.executable, script]
+    return [sys.executable, '-c', 'import SCons.Script; SCons.Script.main()']
+
+
+class SConsTestCase(unittest.TestCase):
+
+    """Each test gets a scratch directory to build in"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='xbs-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write(self, name, text):
+        path = self.path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        f = open(path, 'w')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+
+    def read(self, name):
+        f = open(self.path(name))
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def copy_data(self, *names):
+        for name in names:
+            shutil.copy(os.path.join(DATA, name), self.path(name))
+
+    def sconstruct(self, body):
+        self.write('SConstruct',
+                   SCONSTRUCT_HEAD % {'scons_dir' : os.path.join(REPO, 'scons'),
+                                      'site_tools' : os.path.join(REPO, 'scons', 'site_tools'),
+                                      'bin' : BIN,
+                                      'repo' : REPO,
+                                      'python' : sys.executable}
+                   + body)
+
+    def scons(self, *args):
+        """Run SCons in the scratch directory; its output"""
+        proc = subprocess.Popen(scons_command() + ['-Q'] + list(args),
+                                cwd=self.dir,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        if proc.returncode != 0:
+            self.fail("scons %s failed:\n%s" % (' '.join(args), output))
+        return output
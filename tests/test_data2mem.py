@@ -0,0 +1,57 @@
+import time
+import unittest
+
+from scons_test import SConsTestCase
+
+SCONSTRUCT = '''
+env.PatchBitstreams('design.bit', 'design.bmm',
+                    {'one' : 'a.mem',
+                     'two' : ['a.mem', ('b.mem', 'ram1')],
+                     'three' : [('c.mem', %r), 'b.mem']},
+                    out_dir='out')
+'''
+
+
+class PatchBitstreamsTest(SConsTestCase):
+
+    def setUp(self):
+        SConsTestCase.setUp(self)
+        for name in ['design.bit', 'design.bmm', 'a.mem', 'b.mem', 'c.mem']:
+            self.write(name, name + '\n')
+        self.sconstruct(SCONSTRUCT % ('ram0'))
+
+    def command(self, name):
+        return self.read('out/%s.bit' % (name)).splitlines()[0]
+
+    def test_arguments(self):
+        self.scons('.')
+        self.assertEqual(self.command('one'),
+                         '-bm design.bmm -bt design.bit -bd a.mem -o b out/one.bit')
+        self.assertEqual(self.command('two'),
+                         '-bm design.bmm -bt design.bit -bd a.mem -bd b.mem tag ram1'
+                         ' -o b out/two.bit')
+        self.assertEqual(self.command('three'),
+                         '-bm design.bmm -bt design.bit -bd c.mem tag ram0 -bd b.mem'
+                         ' -o b out/three.bit')
+
+    def test_rebuilds(self):
+        self.scons('.')
+        time.sleep(0.01)
+        self.write('b.mem', 'b.mem, edited\n')
+        output = self.scons('.')
+        self.assertFalse('out/one.bit' in output, output)
+        self.assertTrue('out/two.bit' in output, output)
+        self.assertTrue('out/three.bit' in output, output)
+        self.assertTrue('b.mem, edited' in self.read('out/two.bit'))
+
+    def test_tag_change(self):
+        self.scons('.')
+        self.sconstruct(SCONSTRUCT % ('ram2'))
+        output = self.scons('.')
+        self.assertEqual([line for line in output.splitlines() if 'data2mem' in line],
+                         ['data2mem -bm design.bmm -bt design.bit -bd c.mem tag ram2'
+                          ' -bd b.mem -o b out/three.bit'])
+
+
+if __name__ == '__main__':
+    unittest.main()
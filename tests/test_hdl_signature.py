@@ -0,0 +1,96 @@
+import os
+import time
+import unittest
+
+from scons_test import SConsTestCase
+import hdl_signature
+import xil_ise
+from hdl_signature import semantic_hash
+
+
+def same(a, b, language='verilog'):
+    return semantic_hash(a, language) == semantic_hash(b, language)
+
+
+class SemanticHashTest(unittest.TestCase):
+
+    def test_layout_and_comments(self):
+        self.assertTrue(same('wire  x;\n// note\nassign x = 1;\n',
+                             'wire x; assign x=1; /* other\nnote */'))
+        self.assertTrue(same('a <= b; -- note\n', 'a<=b;', 'vhdl'))
+
+    def test_code_changes(self):
+        self.assertFalse(same('assign x = a + +b;', 'assign x = a ++b;'))
+        self.assertFalse(same('assign x = 1;', 'assign x = 2;'))
+
+    def test_directive_line_ends(self):
+        # The line end ends the macro; without it, wire is in its body
+        self.assertFalse(same('`define W 8\nwire x;\n', '`define W 8 wire x;\n'))
+        self.assertTrue(same('`define W 8 // width\nwire x;\n',
+                             '  `define   W 8\n\nwire\nx;'))
+        self.assertFalse(same('`define W 8 \\\n + 1\nwire x;\n',
+                              '`define W 8\n+ 1\nwire x;\n'))
+        # Only directive lines
+        self.assertTrue(same('wire [`W-1:0]\nx;', 'wire [`W-1:0] x;'))
+
+
+class SavedSigsTest(SConsTestCase):
+
+    """Only the csigs still of use are saved"""
+
+    def setUp(self):
+        SConsTestCase.setUp(self)
+        self.saved = (hdl_signature._by_csig.copy(), hdl_signature._by_path.copy(),
+                      hdl_signature.SEMANTIC_SIGS_SIZE)
+        hdl_signature._by_csig.clear()
+        hdl_signature._by_path.clear()
+        hdl_signature.SEMANTIC_SIGS_SIZE = 2
+
+    def tearDown(self):
+        by_csig, by_path, hdl_signature.SEMANTIC_SIGS_SIZE = self.saved
+        hdl_signature._by_csig.clear()
+        hdl_signature._by_csig.update(by_csig)
+        hdl_signature._by_path.clear()
+        hdl_signature._by_path.update(by_path)
+        SConsTestCase.tearDown(self)
+
+    def test_pruned(self):
+        csigs = []
+        for n in range(5):
+            self.write('top.v', 'wire x%d;\n' % (n))
+            os.utime(self.path('top.v'), (n, n))
+            csigs.append(hdl_signature.file_signatures(self.path('top.v'))[0])
+        # The oldest is used again, so it outlasts the two after it
+        self.assertNotEqual(hdl_signature.semantic_of_csig(csigs[0]), None)
+        hdl_signature.save_semantic_sigs(self.path('sigs'))
+        by_csig, by_path = xil_ise.load_state(self.path('sigs'),
+                                              hdl_signature.SEMANTIC_SIGS_VERSION, 'sigs')
+        self.assertEqual(sorted([csig for (csig, semantic) in by_csig]),
+                         sorted([csigs[4], csigs[3], csigs[0]]))
+        self.assertEqual(by_path.keys(), [self.path('top.v')])
+
+
+class DeciderTest(SConsTestCase):
+
+    """$XISE_SEMANTIC_HDL counts wherever it's set, not just when the
+    tool is set up"""
+
+    def test_set_after_setup(self):
+        self.write('top.v', 'wire x;\n')
+        self.sconstruct('''
+env.Command('plain.out', 'top.v', Copy('$TARGET', '$SOURCE'))
+semantic = env.Clone()
+semantic['XISE_SEMANTIC_HDL'] = True
+semantic.Command('semantic.out', 'top.v', Copy('$TARGET', '$SOURCE'))
+''')
+        self.scons('.')
+        time.sleep(0.01)
+        self.write('top.v', 'wire x; // a comment\n')
+        output = self.scons('.')
+        self.assertTrue('plain.out' in output, output)
+        self.assertFalse('semantic.out' in output, output)
+        self.assertTrue(os.path.exists(self.path('.scons_build_tmp/hdl_semantic_sigs')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+import os
+import re
+import time
+import subprocess
+import unittest
+
+from scons_test import SConsTestCase, DATA, BIN, scons_command
+
+
+class SynthesisDependencyTest(SConsTestCase):
+
+    """sample.xise synthesizes top.v and constrains it with top.ucf"""
+
+    def setUp(self):
+        SConsTestCase.setUp(self)
+        self.copy_data('sample.xise', 'sample.xtclsh_dump')
+        self.write('top.v', 'module top; endmodule\n')
+        self.write('top.ucf', 'NET "clk" LOC = "A1";\n')
+        self.write('build/top.xst', 'run\n-ofn top\n')
+        self.sconstruct('''
+env.Replace(PROJECTFILE='sample.xise', INTSTYLE='silent',
+            PARTNUM='xc6slx45-3-fgg484', UCF='top.ucf')
+env.GetProps(env['XISE_PY_PROPFILE'], 'sample.xise')
+ngc = env.Xst('build/top.ngc', 'build/top.xst')
+env.Ngc2Edif('build/top.ndf', ngc)
+env.Ngd('build/top.ngd', ngc)
+''')
+
+    def edit(self, name, text):
+        # Content changes are what count, but keep the mtime moving
+        time.sleep(0.01)
+        self.write(name, text)
+
+    def test_rebuild_is_a_no_op(self):
+        output = self.scons('.')
+        self.assertTrue('xst -intstyle' in output, output)
+        self.assertTrue('ngdbuild' in output, output)
+        output = self.scons('.')
+        self.assertEqual(output.splitlines()[-1], "scons: `.' is up to date.", output)
+
+    def test_source_edit_resynthesizes(self):
+        self.scons('.')
+        self.edit('top.v', 'module top(input clk); endmodule\n')
+        output = self.scons('build/top.ngc')
+        self.assertTrue('xst -intstyle' in output, output)
+
+    def test_constraints_edit_only_translates(self):
+        self.scons('.')
+        self.edit('top.ucf', 'NET "clk" LOC = "B2";\n')
+        output = self.scons('.')
+        self.assertTrue('ngdbuild' in output, output)
+        self.assertFalse('xst -intstyle' in output, output)
+
+
+class PreconfigTest(SConsTestCase):
+
+    """The .xst script is written from XST's properties, so those
+    are read first"""
+
+    def setUp(self):
+        SConsTestCase.setUp(self)
+        self.copy_data('sample.xise')
+        self.sconstruct('''
+env.Replace(PROJECTFILE='sample.xise', FILE_STEM='top',
+            PARTNUM='xc6slx45-3-fgg484', XISE_NATIVE_PROPS=True)
+env.Preconf_xst('build/top.xst', 'sample.xise')
+env.GetProps(env['XISE_PY_PROPFILE'], 'sample.xise')
+''')
+
+    def set_property(self, name, value):
+        text = self.read('sample.xise')
+        start = text.index('xil_pn:name="%s" xil_pn:value="' % (name))
+        start = text.index('xil_pn:value="', start) + len('xil_pn:value="')
+        end = text.index('"', start)
+        time.sleep(0.01)
+        self.write('sample.xise', text[:start] + value + text[end:])
+
+    def test_xst_property_edit(self):
+        self.scons('build/top.xst')
+        self.assertTrue('-opt_mode Area' in self.read('build/top.xst'))
+        self.set_property('Optimization Goal', 'Speed')
+        self.scons('build/top.xst')
+        self.assertTrue('-opt_mode Speed' in self.read('build/top.xst'))
+
+
+class TwoProjectsTest(SConsTestCase):
+
+    """Two projects, each with its own properties file, in one build"""
+
+    def test_separate_sections(self):
+        for d in ['a', 'b']:
+            self.write(d + '/sample.xise', open(os.path.join(DATA, 'sample.xise')).read())
+        self.write('b/sample.xise', self.read('b/sample.xise').replace(
+            'xil_pn:name="Optimization Goal" xil_pn:value="Area"',
+            'xil_pn:name="Optimization Goal" xil_pn:value="Speed"'))
+        self.sconstruct('''
+for d in ['a', 'b']:
+    e = env.Clone(PROJECTFILE=d + '/sample.xise', FILE_STEM='top',
+                  PARTNUM='xc6slx45-3-fgg484', XISE_NATIVE_PROPS=True,
+                  XISE_PY_PROPFILE=File(d + '/props.prop_list'))
+    e.GetProps(e['XISE_PY_PROPFILE'], d + '/sample.xise')
+    e.Preconf_xst(d + '/top.xst', d + '/sample.xise')
+''')
+        self.scons('.')
+        self.assertTrue('-opt_mode Area' in self.read('a/top.xst'))
+        self.assertTrue('-opt_mode Speed' in self.read('b/top.xst'))
+        self.assertTrue(os.path.exists(self.path('a/props.Synthesize_XST.prop_section')))
+        self.assertTrue(os.path.exists(self.path('b/props.Synthesize_XST.prop_section')))
+
+
+# What process_project_file needs beyond the properties of sample.xise
+PROJECT_PROPERTIES = [('Package', 'fgg484'), ('Speed Grade', '-3'),
+                      ('Working Directory', 'build'),
+                      ('Implementation Top Instance Path', '/top'),
+                      ('Generics, Parameters', '')]
+
+# ngdbuild which waits long enough for another to start, and notes it
+# if one did
+OVERLAP_NGDBUILD = '''#!/bin/sh
+touch %(dir)s/running.$$
+sleep 0.5
+if [ `ls %(dir)s | grep -c '^running'` -gt 1 ]; then echo overlap >> %(dir)s/log; fi
+sleep 0.5
+rm %(dir)s/running.$$
+exec %(ngdbuild)s "$@"
+'''
+
+class VariantsTest(SConsTestCase):
+
+    """Two images from one synthesis of sample.xise, with do_xilinx's
+    variants, each with its own UCF"""
+
+    def setUp(self):
+        SConsTestCase.setUp(self)
+        self.copy_data('sample.xise', 'sample.xtclsh_dump')
+        self.write('sample.xise', self.read('sample.xise').replace(
+            '  </properties>',
+            ''.join(['    <property xil_pn:name="%s" xil_pn:value="%s"/>\n' % (name, value)
+                     for (name, value) in PROJECT_PROPERTIES]) + '  </properties>'))
+        self.write('top.v', 'module top; endmodule\n')
+        for ucf in ['top', 'left', 'right']:
+            self.write(ucf + '.ucf', 'NET "clk" LOC = "A1";\n')
+        self.write('slowbin/ngdbuild', OVERLAP_NGDBUILD % {'dir' : self.path('marks'),
+                                                          'ngdbuild' : os.path.join(BIN, 'ngdbuild')})
+        os.chmod(self.path('slowbin/ngdbuild'), 0755)
+        os.mkdir(self.path('marks'))
+
+    def variants_sconstruct(self, variants):
+        self.sconstruct('''
+import xilinx
+env['ENV']['PATH'] = %r + os.pathsep + env['ENV']['PATH']
+env.GetProps(env['XISE_PY_PROPFILE'], 'sample.xise')
+xilinx.do_xilinx(env, 'sample.xise', '64bit', variants=%r)
+print 'chdir:', sorted([name for (name, builder) in env['BUILDERS'].items()
+                        if builder.executor_kw.get('chdir')])
+''' % (self.path('slowbin'), variants))
+
+    def ngd(self, name):
+        return 'build/%s/top.ngd' % (name)
+
+    def build(self):
+        return self.scons('-j2', self.ngd('left'), self.ngd('right'))
+
+    def test_variants(self):
+        # Relative UCF names, which ngdbuild would look for in its own
+        # directory
+        self.variants_sconstruct([{'name' : 'left', 'UCF' : 'left.ucf'},
+                                  {'name' : 'right', 'UCF' : 'right.ucf'}])
+        output = self.build()
+        self.assertTrue('chdir: []' in output, output)
+        self.assertEqual(len(re.findall('xst -intstyle', output)), 1, output)
+        for name in ['left', 'right']:
+            self.assertTrue('-uc %s ' % (self.path(name + '.ucf')) in self.read(self.ngd(name)))
+        self.assertTrue('overlap' in self.read('marks/log'), output)
+
+        output = self.build()
+        self.assertFalse('ngdbuild' in output, output)
+        self.assertFalse('xst -intstyle' in output, output)
+
+        time.sleep(0.01)
+        self.write('left.ucf', 'NET "clk" LOC = "B2";\n')
+        output = self.build()
+        self.assertTrue('cd %s && ngdbuild' % (self.path('build/left')) in output, output)
+        self.assertFalse('cd %s && ngdbuild' % (self.path('build/right')) in output, output)
+        self.assertFalse('xst -intstyle' in output, output)
+
+    def test_duplicate_names(self):
+        self.variants_sconstruct([{'name' : 'left', 'UCF' : 'left.ucf'},
+                                  {'name' : 'left', 'UCF' : 'right.ucf'}])
+        proc = subprocess.Popen(scons_command() + ['-Q'], cwd=self.dir,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        self.assertNotEqual(proc.returncode, 0, output)
+        self.assertTrue("More than one variant is named 'left'" in output, output)
+
+
+if __name__ == '__main__':
+    unittest.main()
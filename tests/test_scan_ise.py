@@ -0,0 +1,34 @@
+import os
+import unittest
+
+from scons_test import SConsTestCase
+import scan_ise
+
+
+class VhdlPackageTest(SConsTestCase):
+
+    def declare(self, name, package, when):
+        self.write(name, 'package %s is\nend package;\n' % (package))
+        os.utime(self.path(name), (when, when))
+
+    def test_edit_in_place(self):
+        self.declare('a.vhd', 'pkg_a', 1000000000)
+        os.utime(self.dir, (1000000000, 1000000000))
+        self.assertEqual(scan_ise.find_vhdl_package('pkg_a', [self.dir]), self.path('a.vhd'))
+        self.assertEqual(scan_ise.find_vhdl_package('pkg_b', [self.dir]), None)
+        # Editing a file leaves its directory's mtime alone
+        self.declare('a.vhd', 'pkg_b', 1000000010)
+        os.utime(self.dir, (1000000000, 1000000000))
+        self.assertEqual(scan_ise.find_vhdl_package('pkg_b', [self.dir]), self.path('a.vhd'))
+        self.assertEqual(scan_ise.find_vhdl_package('pkg_a', [self.dir]), None)
+
+    def test_new_file(self):
+        self.declare('a.vhd', 'pkg_a', 1000000000)
+        self.assertEqual(scan_ise.find_vhdl_package('pkg_b', [self.dir]), None)
+        self.declare('b.vhd', 'pkg_b', 1000000000)
+        os.utime(self.dir, (1000000010, 1000000010))
+        self.assertEqual(scan_ise.find_vhdl_package('pkg_b', [self.dir]), self.path('b.vhd'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import unittest
+
+from scons_test import SConsTestCase, DATA
+import xil_ise
+
+
+class MemoTest(unittest.TestCase):
+
+    """Options that compare equal but are of different types are
+    translated separately"""
+
+    def test_bool_and_int(self):
+        self.assertEqual(xil_ise.process_xst_opts({'Max Fanout': True})[1],
+                         [['-max_fanout', 'True']])
+        self.assertEqual(xil_ise.process_xst_opts({'Max Fanout': 1})[1],
+                         [['-max_fanout', '1']])
+
+    def test_int_and_float(self):
+        self.assertEqual(xil_ise.process_map_opts({'Register Ordering': 4}),
+                         [['-r', '4']])
+        self.assertRaises(ValueError, xil_ise.process_map_opts,
+                          {'Register Ordering': 4.0})
+
+
+class ReadXiseTest(unittest.TestCase):
+
+    """Sections read past other sections, which are dropped as they go"""
+
+    def test_properties(self):
+        props = xil_ise._read_properties(open(os.path.join(DATA, 'sample.xise')))
+        self.assertEqual(props['Device'], 'xc6slx45')
+        self.assertEqual(len(props), 11)
+        self.assertEqual(xil_ise._read_properties(open(os.path.join(DATA, 'sample.xise')),
+                                                  ['Work Directory']),
+                         {'Work Directory' : './xst'})
+
+    def test_version(self):
+        self.assertEqual(xil_ise._read_version(open(os.path.join(DATA, 'sample.xise'))), '13.4')
+
+
+class StateTest(SConsTestCase):
+
+    """State saved by one run and loaded by the next"""
+
+    def test_round_trip(self):
+        filename = self.path('new/dir/state')
+        xil_ise.save_state(filename, 3, {'a' : [1, 2]})
+        self.assertEqual(xil_ise.load_state(filename, 3, 'state'), {'a' : [1, 2]})
+        self.assertEqual(os.listdir(self.path('new/dir')), ['state'])
+
+    def test_misses(self):
+        filename = self.path('state')
+        self.assertEqual(xil_ise.load_state(filename, 3, 'state'), None)
+        xil_ise.save_state(filename, 2, {'a' : 1})
+        self.assertEqual(xil_ise.load_state(filename, 3, 'state'), None)
+        for text in ['', 'garbage', 'cno_such_module\nThing\n.']:
+            self.write('state', text)
+            self.assertEqual(xil_ise.load_state(filename, 3, 'state'), None)
+
+    def test_unwritable(self):
+        self.write('file', '')
+        self.assertRaises(OSError, xil_ise.save_state, self.path('file/state'), 1, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import glob
+import cPickle
+import unittest
+
+from scons_test import SConsTestCase
+import xparseprops
+
+DUMP = xparseprops.synthetic_dump(processes=3, properties=10)
+
+
+class PropsCacheTest(SConsTestCase):
+
+    def lookup(self):
+        processes = xparseprops.process_cached(DUMP, self.dir)
+        return dict(processes[processes.keys()[1]])
+
+    def entries(self):
+        return glob.glob(os.path.join(self.dir, '*.pickle'))
+
+    def spoil(self, text):
+        for path in self.entries():
+            f = open(path, 'wb')
+            f.write(text)
+            f.close()
+
+    def test_only_what_is_looked_up(self):
+        processes = xparseprops.process_cached(DUMP, self.dir)
+        self.assertEqual(self.entries(), [])
+        first = dict(processes[processes.keys()[1]])
+        self.assertEqual(len(self.entries()), 1)
+        self.assertEqual(self.lookup(), first)
+        self.assertEqual(first, dict(xparseprops.process(DUMP)[processes.keys()[1]]))
+
+    def test_bad_entries_are_misses(self):
+        expected = self.lookup()
+        for text in ['', 'garbage', "S'unterminated\n.",
+                     'cno_such_module\nThing\n.',
+                     cPickle.dumps({'not' : 'a table'})]:
+            self.spoil(text)
+            self.assertEqual(self.lookup(), expected, repr(text))
+
+    def test_unwritable(self):
+        cache_dir = os.path.join(self.dir, 'file')
+        self.write('file', '')
+        processes = xparseprops.process_cached(DUMP, cache_dir)
+        self.assertEqual(len(processes[processes.keys()[0]]), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
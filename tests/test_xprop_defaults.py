@@ -0,0 +1,81 @@
+import unittest
+
+from scons_test import SConsTestCase
+import xil_ise
+import xparseprops
+import xprop_defaults
+
+
+def table_names(process):
+    return set([name for (name, candidates, default)
+                in dict(xprop_defaults.PROCESS_DEFAULTS['13'])[process]])
+
+
+class TableTest(unittest.TestCase):
+
+    """The defaults must name every property the option tables turn
+    into flags, or a natively read dump lacks options a dump from
+    xtclsh has"""
+
+    def test_xst(self):
+        options = set(xil_ise.XST_RUN_OPTS) | set(xil_ise.XST_SET_OPTS)
+        options.discard(None)           # -tmpdir; not a property
+        self.assertEqual(table_names('Synthesize - XST'), options)
+
+    def test_ngdbuild(self):
+        self.assertEqual(table_names('Translate'), set(xil_ise.NGDBUILD_OPTS))
+
+    def test_map(self):
+        self.assertEqual(table_names('Map'), set(xil_ise.MAP_OPTS))
+
+
+class NativeTest(SConsTestCase):
+
+    """GetProps reading sample.xise natively, against the fake xtclsh
+    replaying sample.xtclsh_dump.  The dump was written by hand from
+    the ISE 13 defaults, not recorded from xtclsh, so this checks the
+    reading of the .xise file (stored names, UNKNOWNs, dump format),
+    not the defaults themselves."""
+
+    def build(self):
+        self.sconstruct('''
+env.GetProps('xtclsh.prop_list', 'sample.xise')
+env.Clone(XISE_NATIVE_PROPS=True).GetProps('native.prop_list', 'sample.xise')
+''')
+        output = self.scons('.')
+        self.assertTrue('Reading properties from sample.xise' in output, output)
+        return (output,
+                xparseprops.process(self.read('native.prop_list')),
+                xparseprops.process(self.read('xtclsh.prop_list')))
+
+    def test_native_matches_dump(self):
+        self.copy_data('sample.xise', 'sample.xtclsh_dump')
+        output, native, xtclsh = self.build()
+        self.assertFalse('Asking xtclsh' in output, output)
+        self.assertEqual(sorted(native.keys()), sorted(xprop_defaults.NATIVE_PROCESSES))
+        for process in xprop_defaults.NATIVE_PROCESSES:
+            self.assertEqual(dict(native[process]), dict(xtclsh[process]),
+                             "%s properties differ" % (process))
+        self.assertEqual(xil_ise.process_xst_opts(native['Synthesize - XST']),
+                         xil_ise.process_xst_opts(xtclsh['Synthesize - XST']))
+
+    def test_unknown_property(self):
+        # The project doesn't say, so only xtclsh knows the number of
+        # clock buffers; the rest still comes from the project
+        self.copy_data('sample.xise', 'sample.xtclsh_dump')
+        self.write('sample.xise', '\n'.join([line for line in self.read('sample.xise').splitlines()
+                                              if 'Number of Clock Buffers' not in line]))
+        dump = self.read('sample.xtclsh_dump')
+        self.write('sample.xtclsh_dump',
+                   dump.replace('{{Number of Clock Buffers} : 16}', '{{Number of Clock Buffers} : 8}')
+                       .replace('{{Optimization Goal} : Area}', '{{Optimization Goal} : Speed}'))
+        output, native, xtclsh = self.build()
+        self.assertTrue('Asking xtclsh for properties of Synthesize - XST' in output, output)
+        xst = native['Synthesize - XST']
+        self.assertEqual(xst['Number of Clock Buffers'], 8)
+        self.assertEqual(xst['Optimization Goal'], 'Area')
+        self.assertEqual(len(xst), len(xtclsh['Synthesize - XST']))
+
+
+if __name__ == '__main__':
+    unittest.main()
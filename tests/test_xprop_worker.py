@@ -0,0 +1,60 @@
+import os
+import sys
+import unittest
+
+from scons_test import SConsTestCase, BIN, REPO
+import xparseprops
+import xprop_worker
+
+WORKER = [sys.executable, os.path.join(BIN, 'xtclsh'),
+          os.path.join(REPO, 'xprop_extract.tcl'), '-server']
+
+
+class WorkerTest(SConsTestCase):
+
+    """The stand-in worker prints what ISE prints on stdout ("OK"
+    among it) before each reply"""
+
+    def setUp(self):
+        SConsTestCase.setUp(self)
+        self.copy_data('sample.xise', 'sample.xtclsh_dump')
+        self.worker = xprop_worker.XpropWorker(WORKER)
+
+    def tearDown(self):
+        self.worker.close()
+        SConsTestCase.tearDown(self)
+
+    def test_replies_past_tool_output(self):
+        self.worker.extract(self.path('sample.xise'), self.path('map.prop_list'), ['Map'])
+        self.worker.extract(self.path('sample.xise'), self.path('all.prop_list'))
+        self.assertEqual(xparseprops.process(self.read('map.prop_list')).keys(), ['Map'])
+        self.assertEqual(len(xparseprops.process(self.read('all.prop_list'))), 4)
+
+    def test_error_reply(self):
+        self.assertRaises(xprop_worker.XpropWorkerError, self.worker.extract,
+                          self.path('missing.xise'), self.path('out.prop_list'))
+        # Still serving
+        self.worker.extract(self.path('sample.xise'), self.path('out.prop_list'), ['Map'])
+        self.assertTrue(os.path.exists(self.path('out.prop_list')))
+
+    def test_missing_command(self):
+        worker = xprop_worker.XpropWorker([self.path('no-such-xtclsh'), '-server'])
+        try:
+            worker.extract(self.path('sample.xise'), self.path('out.prop_list'))
+        except xprop_worker.XpropWorkerError, e:
+            self.assertTrue('no-such-xtclsh' in str(e), str(e))
+        else:
+            self.fail("extract() ran without a worker")
+
+    def test_get_props(self):
+        self.sconstruct('''
+env.Clone(XISE_PROPS_WORKER=True).GetProps('worker.prop_list', 'sample.xise')
+env.GetProps('xtclsh.prop_list', 'sample.xise')
+''')
+        self.scons('.')
+        self.assertEqual(xparseprops.process(self.read('worker.prop_list')),
+                         xparseprops.process(self.read('xtclsh.prop_list')))
+
+
+if __name__ == '__main__':
+    unittest.main()
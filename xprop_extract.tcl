@@ -6,10 +6,20 @@
 ## http://www.xilinx.com/support/answers/30962.htm
 ## 
 
-proc get_properties {props_name verbose} {
+proc get_properties {props_name wanted verbose} {
     upvar $props_name props
     set props [list]
     set processes [project get_processes]
+    # Only the processes asked for, if any were
+    if {[llength $wanted] > 0} {
+	set all_processes $processes
+	set processes [list]
+	foreach proc_iter $all_processes {
+	    if {[lsearch -exact $wanted $proc_iter] >= 0} {
+		lappend processes $proc_iter
+	    }
+	}
+    }
     set projName [project get name]
     if $verbose { puts stderr "Reading process properties from $projName" } 
     foreach proc_iter $processes {
@@ -69,12 +79,52 @@ proc open_project {fname verbose} {
 }
 
 
+## Worker mode: read requests from stdin, one Tcl list per line,
+##
+##   projfile out_file ?process ...?
+##
+## and answer each with a line "#xprop_reply# OK" or "#xprop_reply#
+## ERROR message".  ISE writes its own messages to stdout too, so the
+## marker is how the client tells a reply from those.  The interpreter
+## and ISE are only started once for all the requests.  Paths should
+## be absolute, as the working directory may change.
+set reply_marker "#xprop_reply#"
+
+proc serve {verbose} {
+    global reply_marker
+    while {[gets stdin request] >= 0} {
+	if {[string trim $request] == ""} { continue }
+	if [catch {
+	    set projfile [file normalize [lindex $request 0]]
+	    set out_file [file normalize [lindex $request 1]]
+	    if $verbose { puts stderr "Attempting to open $projfile" }
+	    project open $projfile
+	    get_properties properties [lrange $request 2 end] $verbose
+	    simple_text_dump $properties $out_file $verbose
+	} err] {
+	    catch {project close}
+	    puts stdout "$reply_marker ERROR [string map {"\n" " "} $err]"
+	} else {
+	    project close
+	    puts stdout "$reply_marker OK"
+	}
+	flush stdout
+    }
+}
+
+set verbose 0
+if {[lindex $argv 0] == "-server"} {
+    serve $verbose
+    exit 0
+}
+
 # Normalize paths because xtclsh may change directories, causing
 # relative paths to be misinterpreted.
 set projfile [file normalize [lindex $argv 0]]
 set out_file  [file normalize [lindex $argv 1]]
+# Any further arguments name the processes to extract (default: all)
+set wanted [lrange $argv 2 end]
 
-set verbose 0
 open_project $projfile $verbose
-get_properties properties $verbose
+get_properties properties $wanted $verbose
 simple_text_dump $properties $out_file $verbose